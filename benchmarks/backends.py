@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# Licensed to Tomaz Muraus under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Tomaz muraus licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare upload throughput of the executor backends.
+
+Each backend synchronizes the same directory to the simulated storage driver
+with a fixed per-request latency. Backends run in a fresh interpreter
+so the gevent monkey patching doesn't affect the other backends.
+
+Usage: python benchmarks/backends.py [--files=<count>] [--size=<bytes>]
+                                     [--latency=<seconds>]
+                                     [--concurrency=<count>]
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+
+from optparse import OptionParser
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+BACKENDS = ['gevent', 'threads', 'asyncio']
+
+CODE = """
+import time
+import logging
+
+from file_syncer.log import get_logger
+from file_syncer.syncer import FileSyncer
+from file_syncer.simulator import SimulatedStorageDriver
+
+logger = get_logger(handler=logging.StreamHandler(), level=logging.ERROR)
+syncer = FileSyncer(directory=%(directory)r,
+                    provider_cls=SimulatedStorageDriver,
+                    username=%(storage_path)r, api_key='latency=%(latency)f',
+                    container_name='benchmark', cache_path=%(cache_path)r,
+                    exclude_patterns=[], logger=logger,
+                    concurrency=%(concurrency)d, backend=%(backend)r)
+
+start = time.time()
+syncer.sync()
+print(time.time() - start)
+"""
+
+
+def create_files(directory, count, size):
+    data = 'x' * size
+
+    for index in range(count):
+        path = os.path.join(directory, '%04d' % (index // 100))
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        fp = open(os.path.join(path, 'file-%d' % (index)), 'w')
+        fp.write(data)
+        fp.close()
+
+
+def measure(backend, options, directory):
+    env = os.environ.copy()
+    env['PYTHONPATH'] = os.pathsep.join([BASE_DIR,
+                                         env.get('PYTHONPATH', '')])
+    cache_path = tempfile.mkdtemp()
+    storage_path = tempfile.mkdtemp()
+
+    code = CODE % {'latency': options.latency, 'directory': directory,
+                   'cache_path': cache_path, 'storage_path': storage_path,
+                   'backend': backend, 'concurrency': options.concurrency}
+
+    try:
+        process = subprocess.Popen([sys.executable, '-c', code], env=env,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+    finally:
+        shutil.rmtree(cache_path)
+        shutil.rmtree(storage_path)
+
+    if process.returncode != 0:
+        # Backend is not available (e.g. trollius is not installed)
+        return None, stderr.strip().split('\n')[-1]
+
+    return float(stdout.strip()), None
+
+
+def main():
+    usage = ('usage: %prog [--files=<count>] [--size=<bytes>] ' +
+             '[--latency=<seconds>] [--concurrency=<count>]')
+    parser = OptionParser(usage=usage)
+    parser.add_option('--files', dest='files', default=2000, type='int',
+                      help='Number of files')
+    parser.add_option('--size', dest='size', default=64 * 1024, type='int',
+                      help='Size of each file in bytes')
+    parser.add_option('--latency', dest='latency', default=0.02,
+                      type='float', help='Simulated request latency')
+    parser.add_option('--concurrency', dest='concurrency', default=20,
+                      type='int', help='Number of concurrent transfers')
+    (options, args) = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+
+    try:
+        create_files(directory, options.files, options.size)
+
+        print('%-10s %10s %12s %12s' % ('backend', 'took', 'files/s',
+                                        'MB/s'))
+
+        for backend in BACKENDS:
+            took, error = measure(backend, options, directory)
+
+            if took is None:
+                print('%-10s %s' % (backend, error))
+                continue
+
+            megabytes = options.files * options.size / (1024.0 * 1024)
+            print('%-10s %9.2fs %12.1f %12.1f' % (backend, took,
+                                                  options.files / took,
+                                                  megabytes / took))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
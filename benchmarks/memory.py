@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# Licensed to Tomaz Muraus under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Tomaz muraus licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure peak memory used by the in-memory file entries.
+
+Each scenario builds local file entries and parses a remote manifest with the
+same number of files, compares them and then generates a new manifest.
+Scenarios run in a fresh interpreter and the peak RSS on top of the
+interpreter baseline is reported.
+
+Usage: python benchmarks/memory.py [--files=<count>]
+"""
+
+import os
+import sys
+import tempfile
+import subprocess
+
+from optparse import OptionParser
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+SETUP = """
+import copy
+import json
+import resource
+
+from file_syncer.records import FileRecord
+from file_syncer.records import manifest_object_hook, iter_manifest_chunks
+from file_syncer.records import iter_manifest_records
+from file_syncer.diff import SortedRun, iter_differences
+
+def names(count):
+    for index in range(count):
+        yield '/releases/%%04d/%%02d/package-%%d.deb' %% (index // 1000,
+                                                    index %% 100, index)
+
+def sorted_names(count):
+    # Same names as above, generated in the sorted directory walk order
+    for first in range(count // 1000 + 1):
+        for second in range(100):
+            indexes = range(first * 1000 + second,
+                            min((first + 1) * 1000, count), 100)
+            directory = '/releases/%%04d/%%02d/' %% (first, second)
+            for name in sorted(['package-%%d.deb' %% (index)
+                                for index in indexes]):
+                yield directory + name
+
+def read_chunks(path):
+    fp = open(path)
+    while True:
+        chunk = fp.read(1024 * 1024)
+        if not chunk:
+            break
+        yield chunk
+
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+"""
+
+SCENARIOS = [
+    ('dictionaries and deepcopy', """
+data = open(%(manifest_path)r).read()
+local_files = {}
+for name in names(%(count)d):
+    local_files[name] = {'name': name.split('/')[-1], 'remote_name': name,
+                         'path': '/srv/repository' + name,
+                         'last_modified': 1379000001.0, 'md5_hash': None}
+
+remote_files = json.loads(data)
+del data
+new_manifest = copy.deepcopy(remote_files)
+result = json.dumps(new_manifest)
+"""),
+    ('records and overlay', """
+data = open(%(manifest_path)r).read()
+local_files = {}
+for name in names(%(count)d):
+    local_files[name] = FileRecord(remote_name=name,
+                                   last_modified=1379000001.0, size=1024)
+
+remote_files = json.loads(data, object_hook=manifest_object_hook)
+del data
+for chunk in iter_manifest_chunks(remote_files.itervalues()):
+    pass
+"""),
+    ('sorted streams', """
+local_files = (FileRecord(remote_name=name, last_modified=1379000001.0,
+                          size=1024) for name in sorted_names(%(count)d))
+
+remote_files = SortedRun(directory=%(cache_path)r, max_items=100000)
+remote_files.extend(iter_manifest_records(read_chunks(%(manifest_path)r)))
+
+uploaded = SortedRun(directory=%(cache_path)r, max_items=100000)
+for action, local, remote in iter_differences(local_files, remote_files):
+    if action == 'modified':
+        uploaded.add(local)
+
+merged = iter_differences(uploaded, remote_files)
+records = (local or remote for _, local, remote in merged)
+for chunk in iter_manifest_chunks(records):
+    pass
+
+remote_files.close()
+uploaded.close()
+""")
+]
+
+REPORT = """
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(peak - baseline)
+"""
+
+
+def write_manifest(count):
+    """
+    Write a manifest with count entries to a temporary file and return the
+    file path.
+    """
+    fd, path = tempfile.mkstemp(suffix='.json')
+    fp = os.fdopen(fd, 'w')
+    fp.write('{')
+
+    for index in range(count):
+        name = '/releases/%04d/%02d/package-%d.deb' % (index // 1000,
+                                                       index % 100, index)
+        fp.write('%s"%s": {"remote_name": "%s", "last_modified": '
+                 '1379000000.0, "md5_hash": '
+                 '"d41d8cd98f00b204e9800998ecf8427e", "size": 1024}' %
+                 (index and ', ' or '', name, name))
+
+    fp.write('}')
+    fp.close()
+    return path
+
+
+def measure(code, count, manifest_path, cache_path):
+    env = os.environ.copy()
+    env['PYTHONPATH'] = os.pathsep.join([BASE_DIR,
+                                         env.get('PYTHONPATH', '')])
+    code = (SETUP + code + REPORT) % {'count': count,
+                                      'manifest_path': manifest_path,
+                                      'cache_path': cache_path}
+    output = subprocess.Popen([sys.executable, '-c', code], env=env,
+                              stdout=subprocess.PIPE).communicate()[0]
+    # ru_maxrss is reported in kilobytes on Linux
+    return int(output.strip()) / 1024.0
+
+
+def main():
+    parser = OptionParser(usage='usage: %prog [--files=<count>]')
+    parser.add_option('--files', dest='files', default=500000, type='int',
+                      help='Number of files')
+    (options, args) = parser.parse_args()
+
+    manifest_path = write_manifest(options.files)
+    cache_path = tempfile.mkdtemp()
+
+    print('%-30s %12s' % ('scenario (%d files)' % (options.files),
+                          'peak memory'))
+
+    try:
+        for name, code in SCENARIOS:
+            peak = measure(code, options.files, manifest_path, cache_path)
+            print('%-30s %10.1fMB' % (name, peak))
+    finally:
+        os.unlink(manifest_path)
+        os.rmdir(cache_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# Licensed to Tomaz Muraus under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Tomaz muraus licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure startup time of the file-syncer program.
+
+Each scenario is run in a fresh interpreter and the time on top of a bare
+interpreter startup is compared to the scenario budget (in milliseconds).
+Exit code is 1 if any of the scenarios fails or is over budget.
+
+Budgets are based on the measurements with Libcloud 2.8 where importing
+libcloud.storage.base (and requests) alone takes about 125ms.
+
+Usage: python benchmarks/startup.py [--runs=<count>]
+"""
+
+import os
+import sys
+import time
+import subprocess
+
+from optparse import OptionParser
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# (name, code, budget in milliseconds)
+SCENARIOS = [
+    ('import entry point', 'import file_syncer.run', 30),
+    ('import syncer', 'import file_syncer.syncer', 200),
+    ('import syncer and simulator driver',
+     'import file_syncer.syncer\n'
+     'from libcloud.storage.providers import get_driver\n'
+     'from file_syncer.run import get_provider\n'
+     'get_driver(get_provider("SIMULATOR"))', 225),
+    ('import syncer and S3 driver',
+     'import file_syncer.syncer\n'
+     'from libcloud.storage.providers import get_driver\n'
+     'from file_syncer.run import get_provider\n'
+     'get_driver(get_provider("S3"))', 225),
+    ('--help', 'import sys\n'
+               'sys.argv = ["file-syncer", "--help"]\n'
+               'from file_syncer.run import run\n'
+               'try:\n'
+               '    run()\n'
+               'except SystemExit:\n'
+               '    pass', 40)
+]
+
+
+def measure(code, runs):
+    """
+    Return median duration of the code run in milliseconds (or None if the
+    code failed).
+    """
+    env = os.environ.copy()
+    env['PYTHONPATH'] = os.pathsep.join([BASE_DIR,
+                                         env.get('PYTHONPATH', '')])
+    args = [sys.executable, '-c', code]
+
+    timings = []
+    for _ in range(runs):
+        start = time.time()
+
+        try:
+            subprocess.check_call(args, env=env,
+                                  stdout=open(os.devnull, 'w'))
+        except subprocess.CalledProcessError:
+            return None
+
+        timings.append((time.time() - start) * 1000)
+
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def main():
+    parser = OptionParser(usage='usage: %prog [--runs=<count>]')
+    parser.add_option('--runs', dest='runs', default=10, type='int',
+                      help='Number of runs for each scenario')
+    (options, args) = parser.parse_args()
+
+    baseline = measure('pass', options.runs)
+    print('%-36s %10s %10s %10s' % ('scenario', 'median', 'overhead',
+                                    'budget'))
+    print('%-36s %8.1fms' % ('interpreter', baseline))
+
+    over_budget = False
+    for name, code, budget in SCENARIOS:
+        median = measure(code, options.runs)
+
+        if median is None:
+            over_budget = True
+            print('%-36s %10s %10s %8dms FAILED' % (name, '-', '-', budget))
+            continue
+
+        overhead = median - baseline
+        status = ''
+
+        if overhead > budget:
+            over_budget = True
+            status = 'OVER BUDGET'
+
+        print('%-36s %8.1fms %8.1fms %8dms %s' % (name, median, overhead,
+                                                  budget, status))
+
+    sys.exit(over_budget and 1 or 0)
+
+
+if __name__ == '__main__':
+    main()
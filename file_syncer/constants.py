@@ -15,9 +15,77 @@
 
 __all__ = [
     'VALID_LOG_LEVELS',
-    'MANIFEST_FILE'
+    'MANIFEST_FILE',
+    'MANIFEST_SHARD_FILE',
+    'LEASE_SHARD_FILE',
+    'SHARD_DEPTH_SUFFIX',
+    'THROUGHPUT_HISTORY_FILE',
+    'DEFAULT_LEASE_TTL',
+    'DEFAULT_SHARD_DEPTH',
+    'DEFAULT_BACKEND',
+    'DEFAULT_HEDGE_PERCENTILE',
+    'DEFAULT_HEDGE_BUDGET',
+    'DEFAULT_HEDGE_MAX_SIZE',
+    'DEFAULT_CHUNK_SIZE',
+    'DEFAULT_MAX_BUFFER_MEMORY',
+    'DEFAULT_SORT_BUFFER_SIZE',
+    'DEFAULT_SCAN_QUEUE_SIZE',
+    'DEFAULT_DUPLICATES_MODE',
+    'MIN_MULTIPART_PART_SIZE'
 ]
 
 VALID_LOG_LEVELS = ['DEBUG', 'ERROR', 'FATAL', 'CRITICAL', 'INFO', 'WARNING']
 
 MANIFEST_FILE = 'manifest.json'
+
+# Names of the per-shard manifest sections and shard lease objects
+MANIFEST_SHARD_FILE = 'manifest.%(index)d-of-%(count)d%(suffix)s.json'
+LEASE_SHARD_FILE = 'lease.%(index)d-of-%(count)d%(suffix)s.json'
+
+# Suffix of the shard object names if the keyspace is partitioned by more
+# than the top level path component
+SHARD_DEPTH_SUFFIX = '.depth-%(depth)d'
+
+# Name of the file in the cache directory which stores throughput of the
+# previous runs (used to estimate duration of a planned synchronization)
+THROUGHPUT_HISTORY_FILE = 'throughput.json'
+
+# Number of seconds after which a shard lease expires unless it's renewed
+DEFAULT_LEASE_TTL = 300
+
+# Number of leading path components by which the keyspace is partitioned
+DEFAULT_SHARD_DEPTH = 1
+
+# Executor backend which is used to run the remote operations in parallel
+DEFAULT_BACKEND = 'gevent'
+
+# Transfers which take longer than this percentile of the recent transfers
+# are hedged
+DEFAULT_HEDGE_PERCENTILE = 95
+
+# Maximum number of hedged transfers as a fraction of all the transfers
+DEFAULT_HEDGE_BUDGET = 0.05
+
+# Only transfers of the objects up to this size (in bytes) are hedged
+DEFAULT_HEDGE_MAX_SIZE = 4 * 1024 * 1024
+
+# Size of a chunk which is read from a local file and sent over the wire
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# Maximum amount of memory used by all the in-flight upload buffers
+DEFAULT_MAX_BUFFER_MEMORY = 64 * 1024 * 1024
+
+# Maximum number of file entries which are sorted in memory before they are
+# spilled to a temporary file in the cache directory
+DEFAULT_SORT_BUFFER_SIZE = 100000
+
+# Maximum number of local file entries which are read ahead while the
+# manifest is being downloaded
+DEFAULT_SCAN_QUEUE_SIZE = 10000
+
+# How the restored files with duplicate content are materialized (reflink,
+# hardlink, copy or none to download each file)
+DEFAULT_DUPLICATES_MODE = 'reflink'
+
+# Smallest part size of a S3 multipart upload (all but the last part)
+MIN_MULTIPART_PART_SIZE = 5 * 1024 * 1024
@@ -0,0 +1,267 @@
+# Licensed to Tomaz Muraus under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Tomaz muraus licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import heapq
+import tempfile
+import threading
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from file_syncer.records import FileRecord
+
+__all__ = [
+    'sort_key',
+    'content_key',
+    'SortedRun',
+    'RenameDetector',
+    'iter_differences'
+]
+
+
+def sort_key(remote_name):
+    """
+    Return a key used for ordering the files.
+
+    Files are ordered the same way as they are visited by a top-down os.walk
+    with sorted directory listings - files in a directory come before the
+    files in its sub directories and each sub directory is visited as a
+    whole. This means that a sorted directory walk produces records which are
+    already in order and don't need to be sorted.
+    """
+    index = remote_name.rfind('/')
+    name = remote_name[index + 1:]
+
+    # Names don't start with a slash if the directory has a trailing slash
+    directory = ''
+    if index >= 0:
+        directory = remote_name[:index]
+
+    return (tuple([part for part in directory.split('/') if part]), name)
+
+
+def content_key(record):
+    """
+    Return a key which orders the records with the same content (MD5 hash and
+    size) next to each other.
+    """
+    return (record.md5_hash, record.size, sort_key(record.remote_name))
+
+
+class SortedRun(object):
+    """
+    Collection of records which can be iterated in sorted order multiple
+    times.
+
+    Records are kept in memory until there are more than max_items of them.
+    After that, records are sorted and spilled to a temporary file in the
+    provided directory. Iterating over the run merges all the spilled files
+    and the records which are still in memory in a single pass, so the memory
+    usage is bounded by max_items and the number of spilled files.
+
+    Records are ordered by L{sort_key} of their remote names unless a
+    different key function is provided.
+    """
+
+    def __init__(self, directory, max_items, key=None):
+        self._directory = directory
+        self._max_items = max_items
+        self._key = key or (lambda record: sort_key(record.remote_name))
+        self._items = []
+        self._paths = []
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def add(self, record):
+        self._lock.acquire()
+        try:
+            self._items.append(record)
+            self._count += 1
+
+            if len(self._items) >= self._max_items:
+                self._spill()
+        finally:
+            self._lock.release()
+
+    def extend(self, records):
+        for record in records:
+            self.add(record)
+
+    def __iter__(self):
+        self._lock.acquire()
+        try:
+            self._sort_items()
+            iterators = [self._iter_file(path) for path in self._paths]
+            iterators.append(self._iter_keyed(list(self._items)))
+        finally:
+            self._lock.release()
+
+        if len(iterators) == 1:
+            iterable = iterators[0]
+        else:
+            iterable = heapq.merge(*iterators)
+
+        for _, _, record in iterable:
+            yield record
+
+    def close(self):
+        """
+        Remove all the spilled files.
+        """
+        for path in self._paths:
+            if os.path.exists(path):
+                os.unlink(path)
+
+        self._paths = []
+        self._items = []
+        self._count = 0
+
+    def _sort_items(self):
+        self._items.sort(key=self._key)
+
+    def _spill(self):
+        self._sort_items()
+
+        fd, path = tempfile.mkstemp(prefix='run-', suffix='.json',
+                                    dir=self._directory)
+        fp = os.fdopen(fd, 'w')
+
+        try:
+            for record in self._items:
+                fp.write(json.dumps(record.to_dict()))
+                fp.write('\n')
+        finally:
+            fp.close()
+
+        self._paths.append(path)
+        self._items = []
+
+    def _iter_keyed(self, records):
+        # Sequence number keeps the merge stable and means the records
+        # themselves are never compared
+        index = 0
+        for record in records:
+            yield (self._key(record), index, record)
+            index += 1
+
+    def _iter_file(self, path):
+        fp = open(path, 'r')
+
+        try:
+            records = (FileRecord.from_dict(json.loads(line)) for line in fp)
+
+            for item in self._iter_keyed(records):
+                yield item
+        finally:
+            fp.close()
+
+
+def iter_differences(local_records, remote_records):
+    """
+    Compare two sorted streams of records and yield differences between them
+    in a single merge pass.
+
+    Both streams need to be ordered by L{sort_key}.
+
+    @return: An iterator which yields (action, local_record, remote_record)
+             tuples where action is one of the following:
+
+             added - file has been added locally.
+             removed - file has been removed locally.
+             modified - file has been modified locally.
+             unchanged - file has not been modified.
+    """
+    local_iter = iter(local_records)
+    remote_iter = iter(remote_records)
+
+    local_item = next(local_iter, None)
+    remote_item = next(remote_iter, None)
+
+    while local_item is not None or remote_item is not None:
+        if remote_item is None:
+            cmp_result = -1
+        elif local_item is None:
+            cmp_result = 1
+        else:
+            cmp_result = cmp(sort_key(local_item.remote_name),
+                             sort_key(remote_item.remote_name))
+
+        if cmp_result < 0:
+            yield ('added', local_item, None)
+            local_item = next(local_iter, None)
+        elif cmp_result > 0:
+            yield ('removed', None, remote_item)
+            remote_item = next(remote_iter, None)
+        else:
+            if local_item.last_modified > remote_item.last_modified:
+                yield ('modified', local_item, remote_item)
+            else:
+                yield ('unchanged', local_item, remote_item)
+
+            local_item = next(local_iter, None)
+            remote_item = next(remote_iter, None)
+
+
+class RenameDetector(object):
+    """
+    Pairs files which have been added locally with the remote files which
+    have been removed and have the same content (size and MD5 hash).
+
+    Only the sizes of the remote files are known up front so the added files
+    which have the same size as one of the remote files are candidates for
+    a rename. Their hash is only calculated once all the removed files are
+    known.
+    """
+
+    def __init__(self, remote_records):
+        self._sizes = set()
+        self._removed_sizes = set()
+        self._removed = {}
+
+        for record in remote_records:
+            if record.size:
+                self._sizes.add(record.size)
+
+    def is_candidate(self, record):
+        """
+        Return True if the added record might be a renamed remote file.
+        Empty files are never treated as renamed.
+        """
+        return bool(record.size) and record.size in self._sizes
+
+    def add_removed(self, record):
+        if record.size and record.md5_hash:
+            self._removed[(record.size, record.md5_hash)] = record
+            self._removed_sizes.add(record.size)
+
+    def has_removed(self, record):
+        """
+        Return True if the candidate has the same size as one of the removed
+        files and needs to be hashed.
+        """
+        return record.size in self._removed_sizes
+
+    def match(self, record, md5_hash):
+        """
+        Return removed record with the same content or None if there is no
+        such record.
+        """
+        return self._removed.get((record.size, md5_hash), None)
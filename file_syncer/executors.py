@@ -0,0 +1,387 @@
+# Licensed to Tomaz Muraus under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Tomaz muraus licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Executors which run the remote operations (uploads, downloads and deletes) in
+parallel.
+
+All the executors have the same interface - spawn schedules a function call
+and blocks if there are already "concurrency" calls in flight, join waits
+until all the scheduled calls (including the ones scheduled by the calls
+themselves) have finished and close releases the executor resources.
+
+Backend modules are only imported when an executor is created so choosing one
+backend never imports (or patches the interpreter for) the other ones.
+"""
+
+import threading
+
+from Queue import Queue
+
+__all__ = [
+    'BACKENDS',
+    'DetachedCall',
+    'DetachedGreenlet',
+    'Executor',
+    'GeventExecutor',
+    'ThreadExecutor',
+    'AsyncioExecutor',
+    'get_executor_class',
+    'get_asyncio',
+    'monkey_patch'
+]
+
+_monkey_patched = False
+
+
+class DetachedCall(object):
+    """
+    Call which runs in its own thread outside of the executor pool.
+
+    Threads can't be interrupted so cancelling a call only means its result
+    is not going to be used.
+    """
+
+    def __init__(self, func, *args):
+        self._thread = threading.Thread(target=func, args=args)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def cancel(self):
+        pass
+
+
+class DetachedGreenlet(object):
+    """
+    Call which runs in its own greenlet outside of the executor pool.
+    """
+
+    def __init__(self, func, *args):
+        import gevent
+        self._greenlet = gevent.spawn(func, *args)
+
+    def cancel(self):
+        if not self._greenlet.ready():
+            self._greenlet.kill(block=False)
+
+
+def monkey_patch():
+    """
+    Monkey patch the standard library so the blocking calls cooperate with
+    gevent.
+
+    This is done lazily, the first time a gevent executor is needed, so runs
+    which have nothing to transfer or use a different backend don't pay the
+    price for importing gevent and patching the interpreter.
+    """
+    global _monkey_patched
+
+    if _monkey_patched:
+        return
+
+    from gevent import monkey
+    monkey.patch_all()
+    _monkey_patched = True
+
+
+class Executor(object):
+    """
+    Base executor class.
+    """
+
+    name = None
+
+    def __init__(self, concurrency, logger=None):
+        self.concurrency = concurrency
+        self._logger = logger
+
+    @classmethod
+    def prepare(cls):
+        """
+        Prepare the interpreter for this backend.
+
+        This needs to be called before any locks or threads which are used
+        together with the executor are created.
+        """
+        pass
+
+    @classmethod
+    def check_dependencies(cls):
+        """
+        Raise L{ValueError} if a library which is required by this backend is
+        not installed.
+        """
+        pass
+
+    @classmethod
+    def detach(cls, func, *args):
+        """
+        Run a call outside of the executor pool (so it doesn't take a slot
+        of the call which has started it) and return a handle which can be
+        used to cancel it.
+        """
+        return DetachedCall(func, *args)
+
+    def spawn(self, func, *args):
+        raise NotImplementedError('spawn not implemented for this executor')
+
+    def join(self):
+        raise NotImplementedError('join not implemented for this executor')
+
+    def close(self):
+        pass
+
+    def _log_error(self, func, error):
+        if self._logger:
+            self._logger.error('Task %(func)s failed: %(error)s',
+                               {'func': func, 'error': str(error)})
+
+
+class GeventExecutor(Executor):
+    """
+    Executor which runs each call in a greenlet from a gevent pool.
+    """
+
+    name = 'gevent'
+
+    def __init__(self, concurrency, logger=None):
+        super(GeventExecutor, self).__init__(concurrency=concurrency,
+                                             logger=logger)
+        self.prepare()
+
+        from gevent.pool import Pool
+        self._pool = Pool(concurrency)
+
+    @classmethod
+    def prepare(cls):
+        monkey_patch()
+
+    @classmethod
+    def detach(cls, func, *args):
+        return DetachedGreenlet(func, *args)
+
+    def spawn(self, func, *args):
+        return self._pool.spawn(func, *args)
+
+    def join(self):
+        self._pool.join()
+
+
+class _ThreadedExecutor(Executor):
+    """
+    Base class for the executors which run calls in the worker threads.
+
+    Calls which are scheduled by a worker thread (e.g. retries) never block,
+    otherwise all the workers could end up waiting for a free slot.
+    """
+
+    def __init__(self, concurrency, logger=None):
+        super(_ThreadedExecutor, self).__init__(concurrency=concurrency,
+                                                logger=logger)
+        self._slots = threading.Semaphore(concurrency)
+        self._condition = threading.Condition()
+        self._pending = 0
+        self._local = threading.local()
+
+    def spawn(self, func, *args):
+        acquired = False
+
+        if not getattr(self._local, 'is_worker', False):
+            self._slots.acquire()
+            acquired = True
+
+        self._condition.acquire()
+        try:
+            self._pending += 1
+        finally:
+            self._condition.release()
+
+        self._submit(func, args, acquired)
+
+    def join(self):
+        self._condition.acquire()
+        try:
+            while self._pending:
+                self._condition.wait()
+        finally:
+            self._condition.release()
+
+    def _submit(self, func, args, acquired):
+        raise NotImplementedError('_submit not implemented for this executor')
+
+    def _run(self, func, args):
+        self._local.is_worker = True
+
+        try:
+            func(*args)
+        except Exception, e:
+            self._log_error(func=func, error=e)
+
+    def _done(self, acquired):
+        if acquired:
+            self._slots.release()
+
+        self._condition.acquire()
+        try:
+            self._pending -= 1
+            self._condition.notify_all()
+        finally:
+            self._condition.release()
+
+
+class ThreadExecutor(_ThreadedExecutor):
+    """
+    Executor which runs calls in a pool of threads.
+
+    Worker threads are started when the first call is scheduled.
+    """
+
+    name = 'threads'
+
+    def __init__(self, concurrency, logger=None):
+        super(ThreadExecutor, self).__init__(concurrency=concurrency,
+                                             logger=logger)
+        self._queue = Queue()
+        self._threads = []
+
+    def close(self):
+        for _ in self._threads:
+            self._queue.put(None)
+
+        for thread in self._threads:
+            thread.join()
+
+        self._threads = []
+
+    def _submit(self, func, args, acquired):
+        if not self._threads:
+            self._start()
+
+        self._queue.put((func, args, acquired))
+
+    def _start(self):
+        for _ in range(0, self.concurrency):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+
+            if task is None:
+                return
+
+            func, args, acquired = task
+
+            try:
+                self._run(func, args)
+            finally:
+                self._done(acquired)
+
+
+class AsyncioExecutor(_ThreadedExecutor):
+    """
+    Executor which schedules calls on an asyncio event loop.
+
+    Libcloud drivers are blocking so the calls themselves are run in the loop
+    default executor which is limited to "concurrency" threads. Loop runs in
+    a background thread so the executor can be used from the synchronous
+    code. Trollius is used on the Python versions without asyncio.
+    """
+
+    name = 'asyncio'
+
+    @classmethod
+    def check_dependencies(cls):
+        try:
+            get_asyncio()
+
+            import concurrent.futures
+            concurrent.futures
+        except ImportError, e:
+            raise ValueError('Missing library which is required by the ' +
+                             'asyncio backend (%s). On Python 2 you can ' %
+                             (str(e)) + 'install "trollius" and "futures" ' +
+                             'libraries using pip: pip install ' +
+                             '"file_syncer[asyncio]"')
+
+    def __init__(self, concurrency, logger=None):
+        super(AsyncioExecutor, self).__init__(concurrency=concurrency,
+                                              logger=logger)
+        self._asyncio = get_asyncio()
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        self._loop = self._asyncio.new_event_loop()
+        self._loop.set_default_executor(
+            ThreadPoolExecutor(max_workers=concurrency))
+
+        self._thread = threading.Thread(target=self._run_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        if self._thread is None:
+            return
+
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+        self._loop.close()
+
+    def _run_loop(self):
+        self._asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def _submit(self, func, args, acquired):
+        self._loop.call_soon_threadsafe(self._schedule, func, args, acquired)
+
+    def _schedule(self, func, args, acquired):
+        future = self._loop.run_in_executor(None, self._run, func, args)
+        future.add_done_callback(lambda future: self._done(acquired))
+
+
+def get_asyncio():
+    try:
+        import asyncio
+    except ImportError:
+        import trollius as asyncio
+
+    return asyncio
+
+
+BACKENDS = {
+    'gevent': GeventExecutor,
+    'threads': ThreadExecutor,
+    'asyncio': AsyncioExecutor
+}
+
+
+def get_executor_class(name):
+    """
+    Return executor class for the provided backend name.
+
+    L{ValueError} is raised if the backend doesn't exist or if its libraries
+    are not installed.
+    """
+    if name not in BACKENDS:
+        raise ValueError('Invalid backend: %s. Valid backends are: %s' %
+                         (name, ', '.join(sorted(BACKENDS.keys()))))
+
+    executor_cls = BACKENDS[name]
+    executor_cls.check_dependencies()
+    return executor_cls
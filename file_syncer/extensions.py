@@ -0,0 +1,288 @@
+# Licensed to Tomaz Muraus under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Tomaz muraus licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Provider specific operations which are not (yet) exposed by the Libcloud
+storage API.
+
+Extensions are looked up by the driver class name so the provider driver
+modules don't need to be imported just to check if an extension is available.
+"""
+
+import base64
+import hashlib
+
+from urllib import quote as urlquote
+from xml.sax.saxutils import escape as xml_escape
+
+from libcloud.common.types import LibcloudError
+
+__all__ = [
+    'ProviderExtension',
+    'S3Extension',
+    'SwiftExtension',
+    'SimulatorExtension',
+    'get_extension'
+]
+
+
+class ProviderExtension(object):
+    """
+    Base class for provider specific operations.
+    """
+
+    # Maximum number of objects which can be deleted using a single bulk
+    # delete request. None means bulk delete is not supported.
+    bulk_delete_batch_size = None
+
+    # Maximum size of an object which can be copied using a single server
+    # side copy request. None means server side copy is not supported.
+    copy_object_max_size = None
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def bulk_delete(self, container, names):
+        """
+        Delete multiple objects using a single request.
+
+        @return: A dictionary with an error message for each object which
+                 couldn't be deleted. Objects which don't exist are treated
+                 as deleted.
+        @rtype: C{dict}
+        """
+        raise NotImplementedError('bulk_delete not implemented for this ' +
+                                  'provider')
+
+    def copy_object(self, container, name, destination_container,
+                    destination_name=None):
+        """
+        Copy an object to another container or under another name (defaults
+        to the same name) without downloading it.
+        """
+        raise NotImplementedError('copy_object not implemented for this ' +
+                                  'provider')
+
+    def _encode(self, value):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+
+        return value
+
+
+class S3Extension(ProviderExtension):
+    """
+    Extension for Amazon S3 and S3 compatible providers.
+    """
+
+    bulk_delete_batch_size = 1000
+
+    # Larger objects need to be copied using a multipart upload
+    copy_object_max_size = 5 * 1024 * 1024 * 1024
+
+    def bulk_delete(self, container, names):
+        # Multi-Object Delete:
+        # http://docs.aws.amazon.com/AmazonS3/latest/API/multiobjectdeleteapi.html
+        driver = self.driver
+        body = ['<?xml version="1.0" encoding="UTF-8"?>',
+                '<Delete><Quiet>true</Quiet>']
+
+        # Error keys are matched against the encoded object names (parsed
+        # keys are unicode if they contain non-ASCII characters)
+        keys = {}
+        for name in names:
+            key = self._encode(name)
+            keys[key] = name
+            body.append('<Object><Key>%s</Key></Object>' % (xml_escape(key)))
+
+        body.append('</Delete>')
+        body = ''.join(body)
+
+        headers = {'Content-Type': 'application/xml',
+                   'Content-MD5': base64.b64encode(hashlib.md5(body).digest())}
+        path = '%s?delete' % (driver._get_container_path(container))
+        response = driver.connection.request(path, method='POST', data=body,
+                                             headers=headers)
+
+        if response.status != 200:
+            raise LibcloudError('Unexpected status code: %s' %
+                                (response.status), driver=driver)
+
+        result = {}
+        namespace = getattr(driver, 'namespace', None)
+        tag = namespace and '{%s}%%s' % (namespace) or '%s'
+
+        for element in response.object.findall(tag % ('Error')):
+            key = element.findtext(tag % ('Key'))
+            code = element.findtext(tag % ('Code'))
+
+            if code == 'NoSuchKey':
+                continue
+
+            message = element.findtext(tag % ('Message'))
+            name = keys.get(self._encode(key), key)
+            result[name] = '%s: %s' % (code, message)
+
+        return result
+
+    def copy_object(self, container, name, destination_container,
+                    destination_name=None):
+        # PUT Object - Copy:
+        # http://docs.aws.amazon.com/AmazonS3/latest/API/RESTObjectCOPY.html
+        driver = self.driver
+        name = self._encode(name)
+        destination_name = self._encode(destination_name or name)
+
+        source = driver._get_object_path(container, name)
+        headers = {'x-amz-copy-source': source,
+                   'x-amz-metadata-directive': 'COPY',
+                   'Content-Length': '0'}
+        path = driver._get_object_path(destination_container,
+                                       destination_name)
+        response = driver.connection.request(path, method='PUT',
+                                             headers=headers)
+
+        # Copy request can fail after the 200 status code has been sent
+        body = response.object
+        tag = getattr(body, 'tag', '') or ''
+        if response.status != 200 or tag.endswith('Error'):
+            raise LibcloudError('Failed to copy object %s: %s' %
+                                (name, response.status), driver=driver)
+
+
+class SwiftExtension(ProviderExtension):
+    """
+    Extension for OpenStack Swift and Rackspace CloudFiles.
+    """
+
+    # Default value of max_deletes_per_request in the bulk middleware
+    bulk_delete_batch_size = 10000
+
+    # Default value of max_file_size, larger objects are segmented
+    copy_object_max_size = 5 * 1024 * 1024 * 1024
+
+    def bulk_delete(self, container, names):
+        # Bulk delete middleware:
+        # http://docs.openstack.org/developer/swift/misc.html#module-swift.common.middleware.bulk
+        driver = self.driver
+        container_name = driver._encode_container_name(container.name)
+
+        # Error paths are matched against both, encoded and decoded object
+        # paths
+        paths = {}
+        lines = []
+        for name in names:
+            path = '/%s/%s' % (container_name,
+                               urlquote(self._encode(name)))
+            paths[path] = name
+            paths['/%s/%s' % (container.name, name)] = name
+            lines.append(path)
+
+        body = '\n'.join(lines)
+        headers = {'Content-Type': 'text/plain',
+                   'Accept': 'application/json'}
+        response = driver.connection.request('', method='DELETE', data=body,
+                                             headers=headers,
+                                             params={'bulk-delete': 'true'})
+
+        data = response.object
+
+        if response.status != 200 or not isinstance(data, dict):
+            raise LibcloudError('Unexpected status code: %s' %
+                                (response.status), driver=driver)
+
+        result = {}
+
+        for path, status in data.get('Errors', []):
+            name = paths.get(path, path)
+            result[name] = status
+
+        status = data.get('Response Status', '200 OK')
+        if not status.startswith('200') and not result:
+            raise LibcloudError('Bulk delete failed: %s' % (status),
+                                driver=driver)
+
+        return result
+
+    def copy_object(self, container, name, destination_container,
+                    destination_name=None):
+        # Server side object copy:
+        # http://docs.openstack.org/api/openstack-object-storage/1.0/content/copy-object.html
+        driver = self.driver
+        destination_name = driver._encode_object_name(
+            self._encode(destination_name or name))
+        name = driver._encode_object_name(self._encode(name))
+
+        source = '/%s/%s' % (driver._encode_container_name(container.name),
+                             name)
+        path = '/%s/%s' % (
+            driver._encode_container_name(destination_container.name),
+            destination_name)
+        headers = {'X-Copy-From': source, 'Content-Length': '0'}
+        response = driver.connection.request(path, method='PUT',
+                                             headers=headers)
+
+        if response.status != 201:
+            raise LibcloudError('Failed to copy object %s: %s' %
+                                (name, response.status), driver=driver)
+
+
+class SimulatorExtension(ProviderExtension):
+    """
+    Extension for the simulated storage driver.
+    """
+
+    bulk_delete_batch_size = 1000
+    copy_object_max_size = 5 * 1024 * 1024 * 1024
+
+    def bulk_delete(self, container, names):
+        return self.driver.ex_bulk_delete(container=container, names=names)
+
+    def copy_object(self, container, name, destination_container,
+                    destination_name=None):
+        self.driver.ex_copy_object(container=container, name=name,
+                                   destination_container=destination_container,
+                                   destination_name=destination_name)
+
+
+# Maps fully qualified driver class names to extension classes. Subclasses of
+# those drivers (e.g. regional drivers) use the same extension unless they are
+# explicitly mapped to None.
+EXTENSIONS = {
+    'libcloud.storage.drivers.google_storage.GoogleStorageDriver': None,
+    'libcloud.storage.drivers.s3.S3StorageDriver': S3Extension,
+    'libcloud.storage.drivers.cloudfiles.CloudFilesStorageDriver':
+    SwiftExtension,
+    'file_syncer.simulator.SimulatedStorageDriver': SimulatorExtension
+}
+
+
+def get_extension(driver):
+    """
+    Return extension instance for the provided driver or None if there is no
+    extension for this driver.
+    """
+    for cls in type(driver).__mro__:
+        name = '%s.%s' % (cls.__module__, cls.__name__)
+
+        if name in EXTENSIONS:
+            extension_cls = EXTENSIONS[name]
+
+            if extension_cls is None:
+                return None
+
+            return extension_cls(driver=driver)
+
+    return None
@@ -0,0 +1,177 @@
+# Licensed to Tomaz Muraus under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Tomaz muraus licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Hedged requests - if a transfer takes longer than most of the transfers
+during the run, a duplicate transfer is started and the first one to finish
+wins.
+"""
+
+import time
+import threading
+
+from Queue import Queue, Empty
+from collections import deque
+
+__all__ = [
+    'LatencyTracker',
+    'Hedger'
+]
+
+
+class LatencyTracker(object):
+    """
+    Keeps track of the recent durations of an operation.
+    """
+
+    def __init__(self, max_samples=1000, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=max_samples)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, duration):
+        self._samples.append(duration)
+
+    def percentile(self, percentile):
+        """
+        Return the provided percentile of the recent durations or None if
+        there are not enough samples yet.
+        """
+        if len(self._samples) < self.min_samples:
+            return None
+
+        samples = sorted(self._samples)
+        index = int(round((len(samples) - 1) * percentile / 100.0))
+        return samples[index]
+
+
+class Hedger(object):
+    """
+    Runs calls with hedging.
+
+    Call is started in a detached worker and if it doesn't finish within the
+    latency percentile of the same kind of calls, a duplicate call is started.
+    First call which succeeds wins and the other one is cancelled (or, if the
+    executor can't cancel it, its result is discarded once it finishes).
+
+    Number of hedges is limited by the budget which is a fraction of all the
+    hedged calls.
+    """
+
+    def __init__(self, executor_cls, percentile, budget, logger):
+        self.percentile = percentile
+        self.budget = budget
+        self.issued = 0
+        self.won = 0
+        self.calls = 0
+
+        self._executor_cls = executor_cls
+        self._logger = logger
+        self._trackers = {}
+        self._lock = threading.Lock()
+
+    def run(self, kind, func, discard=None):
+        """
+        Run func with hedging and return its result.
+
+        @param kind: Kind of the call (e.g. upload), latencies are tracked
+                     separately for each kind.
+        @param func: Function which performs the call. It's called without
+                     any arguments and needs to use its own driver instance.
+        @param discard: Function which is called with the result of a call
+                        which has finished after another call has already won.
+        """
+        self._lock.acquire()
+        try:
+            self.calls += 1
+            tracker = self._trackers.setdefault(kind, LatencyTracker())
+            threshold = tracker.percentile(self.percentile)
+        finally:
+            self._lock.release()
+
+        results = Queue()
+        state = {'winner': None}
+
+        def attempt(index):
+            start = time.time()
+
+            try:
+                value = func()
+            except BaseException, e:
+                results.put((index, None, e))
+                return
+
+            self._lock.acquire()
+            try:
+                won = state['winner'] is None
+
+                if won:
+                    state['winner'] = index
+                    tracker.add(time.time() - start)
+            finally:
+                self._lock.release()
+
+            if won:
+                results.put((index, value, None))
+            elif discard:
+                discard(value)
+
+        calls = [self._executor_cls.detach(attempt, 0)]
+
+        try:
+            index, value, error = results.get(timeout=threshold)
+        except Empty:
+            if not self._acquire_budget():
+                index, value, error = results.get()
+            else:
+                self._logger.debug('Call took more than %(threshold)0.2f ' +
+                                   'seconds, hedging it',
+                                   {'threshold': threshold})
+                calls.append(self._executor_cls.detach(attempt, 1))
+                index, value, error = results.get()
+
+                if error is not None:
+                    # Other call might still succeed
+                    first_error = error
+                    index, value, error = results.get()
+                    error = error and first_error
+
+        for call in calls:
+            call.cancel()
+
+        if error is not None:
+            raise error
+
+        if index == 1:
+            self._lock.acquire()
+            try:
+                self.won += 1
+            finally:
+                self._lock.release()
+
+        return value
+
+    def _acquire_budget(self):
+        self._lock.acquire()
+        try:
+            if self.issued + 1 > self.budget * self.calls:
+                return False
+
+            self.issued += 1
+            return True
+        finally:
+            self._lock.release()
@@ -0,0 +1,128 @@
+# Licensed to Tomaz Muraus under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Tomaz muraus licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Throughput of the previous runs which is used to estimate how long a planned
+synchronization is going to take.
+"""
+
+import os
+import tempfile
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+__all__ = [
+    'ThroughputHistory'
+]
+
+
+class ThroughputHistory(object):
+    """
+    Number of objects, bytes and seconds of the recent transfers of each kind
+    (e.g. upload, remove) stored in a JSON file.
+
+    Only the last max_runs samples of each kind are kept so the estimates
+    follow the changes in the provider performance and concurrency.
+    """
+
+    def __init__(self, path, max_runs=10):
+        self.path = path
+        self.max_runs = max_runs
+        self._samples = None
+
+    def record(self, kind, count, size, seconds):
+        """
+        Record a transfer of count objects with the total size of size bytes
+        which took the provided number of seconds.
+        """
+        samples = self._load().setdefault(kind, [])
+        samples.append({'count': count, 'size': size, 'seconds': seconds})
+        del samples[:-self.max_runs]
+
+        self._save()
+
+    def estimate(self, kind, count, size):
+        """
+        Return estimated number of seconds needed to transfer count objects
+        with the total size of size bytes or None if there are no recorded
+        transfers of this kind.
+
+        Estimate is based on the objects per second and bytes per second
+        rates of the recorded transfers, whichever is the slower one for
+        the provided transfer.
+        """
+        samples = self._load().get(kind, [])
+
+        if not samples:
+            return None
+
+        if not count:
+            return 0.0
+
+        total_count = sum([sample['count'] for sample in samples])
+        total_size = sum([sample['size'] for sample in samples])
+        total_seconds = sum([sample['seconds'] for sample in samples])
+
+        ratios = [count / float(max(total_count, 1))]
+
+        if total_size:
+            ratios.append(size / float(total_size))
+
+        return total_seconds * max(ratios)
+
+    def get_run_count(self, kind):
+        return len(self._load().get(kind, []))
+
+    def _load(self):
+        if self._samples is not None:
+            return self._samples
+
+        self._samples = {}
+
+        if not os.path.exists(self.path):
+            return self._samples
+
+        fp = open(self.path, 'r')
+
+        try:
+            content = fp.read()
+        finally:
+            fp.close()
+
+        try:
+            samples = json.loads(content)
+        except ValueError:
+            # Corrupted history is not fatal, it's rebuilt by the next runs
+            samples = None
+
+        if isinstance(samples, dict):
+            self._samples = samples
+
+        return self._samples
+
+    def _save(self):
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path),
+                                         prefix='.throughput.')
+        fp = os.fdopen(fd, 'w')
+
+        try:
+            fp.write(json.dumps(self._samples))
+        finally:
+            fp.close()
+
+        os.rename(temp_path, self.path)
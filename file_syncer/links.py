@@ -0,0 +1,101 @@
+# Licensed to Tomaz Muraus under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Tomaz muraus licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Functions for materializing local files which have the same content as an
+already restored file without downloading them again.
+"""
+
+import os
+import shutil
+import binascii
+
+__all__ = [
+    'LINK_MODES',
+    'link_file',
+    'reflink'
+]
+
+# Supported modes. Reflinks are copy-on-write clones which don't share
+# changes (unlike hardlinks). If a mode is not supported by the file system,
+# the file is copied instead.
+LINK_MODES = ['reflink', 'hardlink', 'copy']
+
+# ioctl request number for cloning a file on Linux (_IOW(0x94, 9, int))
+FICLONE = 0x40049409
+
+
+def reflink(source, destination):
+    """
+    Create a copy-on-write clone of the source file.
+
+    @raise IOError: If the platform or the file system doesn't support it.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        raise IOError('Reflinks are not supported on this platform')
+
+    source_fp = open(source, 'rb')
+
+    try:
+        destination_fp = open(destination, 'wb')
+
+        try:
+            fcntl.ioctl(destination_fp.fileno(), FICLONE, source_fp.fileno())
+        finally:
+            destination_fp.close()
+    finally:
+        source_fp.close()
+
+
+def link_file(source, destination, mode):
+    """
+    Make destination a file with the same content as source and return the
+    method which has been used (one of L{LINK_MODES}).
+
+    If linking is not allowed (e.g. the files are on different file systems
+    or the file system doesn't support reflinks), the file is copied. The
+    existing destination file is replaced atomically.
+    """
+    dirname, basename = os.path.split(destination)
+    temp_path = os.path.join(dirname, '.%s.%s' %
+                             (basename, binascii.hexlify(os.urandom(4))))
+
+    methods = {'reflink': reflink, 'hardlink': os.link,
+               'copy': shutil.copyfile}
+
+    try:
+        if mode != 'copy':
+            try:
+                methods[mode](source, temp_path)
+            except (IOError, OSError):
+                _remove(temp_path)
+                mode = 'copy'
+
+        if mode == 'copy':
+            shutil.copyfile(source, temp_path)
+
+        os.rename(temp_path, destination)
+    except BaseException:
+        _remove(temp_path)
+        raise
+
+    return mode
+
+
+def _remove(path):
+    if os.path.exists(path):
+        os.unlink(path)
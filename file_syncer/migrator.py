@@ -0,0 +1,533 @@
+# Licensed to Tomaz Muraus under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Tomaz muraus licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+import hashlib
+import tempfile
+
+from collections import defaultdict
+
+from libcloud.storage.base import Container
+from libcloud.storage.types import ContainerDoesNotExistError
+from libcloud.storage.types import ObjectDoesNotExistError
+from libcloud.storage.types import ObjectHashMismatchError
+from libcloud.common.types import LibcloudError
+
+from file_syncer.file_lock import FileLock
+from file_syncer.exceptions import CorruptManifestError
+from file_syncer.extensions import get_extension
+from file_syncer.executors import get_executor_class
+from file_syncer.records import record_from_object, get_object_md5_hash
+from file_syncer.records import iter_manifest_chunks, iter_manifest_records
+from file_syncer.records import parse_timestamp
+from file_syncer.diff import SortedRun, iter_differences
+from file_syncer.sharding import get_shard, is_internal_object
+from file_syncer.sharding import get_shard_object_name
+from file_syncer.sharding import parse_manifest_section
+from file_syncer.streaming import BufferBudget, StreamChunkIterator
+from file_syncer.syncer import get_driver_instance, driver_supports_streaming
+from file_syncer.syncer import get_multipart_part_size
+from file_syncer.constants import MANIFEST_FILE
+from file_syncer.constants import MANIFEST_SHARD_FILE
+from file_syncer.constants import DEFAULT_BACKEND
+from file_syncer.constants import DEFAULT_CHUNK_SIZE
+from file_syncer.constants import DEFAULT_MAX_BUFFER_MEMORY
+from file_syncer.constants import DEFAULT_SORT_BUFFER_SIZE
+
+__all__ = [
+    'StorageEndpoint',
+    'ContainerMigrator'
+]
+
+
+class StorageEndpoint(object):
+    """
+    Container on a storage provider which is used as a migration source or
+    destination.
+    """
+
+    def __init__(self, provider_cls, username, api_key, container_name,
+                 provider=None, region=None):
+        self.provider_cls = provider_cls
+        self.username = username
+        self.api_key = api_key
+        self.container_name = container_name
+        self.provider = provider
+        self.region = region
+
+    def get_driver(self, logger):
+        return get_driver_instance(provider_cls=self.provider_cls,
+                                   username=self.username,
+                                   api_key=self.api_key, logger=logger,
+                                   provider=self.provider,
+                                   region=self.region)
+
+    def get_container(self, driver):
+        return Container(name=self.container_name, extra={}, driver=driver)
+
+    def is_same_account(self, other):
+        """
+        Return True if both endpoints belong to the same provider account and
+        region, which means objects can be copied between them server side.
+        """
+        return (self.provider_cls is other.provider_cls and
+                self.username == other.username and
+                self.region == other.region)
+
+    def __repr__(self):
+        return ('<StorageEndpoint: provider=%s, container_name=%s>' %
+                (self.provider_cls.name, self.container_name))
+
+
+class ContainerMigrator(object):
+    """
+    Copies objects and the manifest from one container to another without
+    staging them on the local disk.
+
+    Objects are streamed from the source to the destination driver in chunks
+    which are accounted for in the global buffer budget. If both containers
+    belong to the same account of a provider which supports it, objects are
+    copied server side instead. Objects which already exist at the
+    destination with the same size and hash are skipped.
+
+    Destination drivers which can't upload a stream without reading it all in
+    memory are given a temporary file in the cache directory instead.
+    """
+
+    def __init__(self, source, destination, cache_path, logger,
+                 concurrency=20, retry_limit=3, server_side_copy=True,
+                 chunk_size=DEFAULT_CHUNK_SIZE,
+                 max_buffer_memory=DEFAULT_MAX_BUFFER_MEMORY,
+                 sort_buffer_size=DEFAULT_SORT_BUFFER_SIZE,
+                 backend=DEFAULT_BACKEND):
+        self._source = source
+        self._destination = destination
+        self._cache_path = cache_path
+        self._logger = logger
+        self._concurrency = concurrency
+        self._retry_limit = retry_limit
+        self._retries = defaultdict(int)
+        self._server_side_copy = server_side_copy
+        self._chunk_size = min(chunk_size, max_buffer_memory)
+        self._max_buffer_memory = max_buffer_memory
+        self._buffer_budget = None
+        self._sort_buffer_size = sort_buffer_size
+        self._executor_cls = get_executor_class(backend)
+
+        self._migrated = []
+        self._copy_extension = None
+
+        self._logger.info('Migrating from %(source)s to %(destination)s',
+                          {'source': source, 'destination': destination})
+
+        self._setup_cache_path()
+        self._setup_container()
+
+    def _setup_cache_path(self):
+        if not os.path.exists(self._cache_path):
+            os.makedirs(self._cache_path)
+
+    def _setup_container(self):
+        """
+        Create a destination container if it doesn't already exist.
+        """
+        driver = self._destination.get_driver(logger=self._logger)
+
+        try:
+            driver.get_container(
+                container_name=self._destination.container_name)
+        except ContainerDoesNotExistError:
+            self._logger.debug('Container "%(name)s" doesn\'t exist, ' +
+                               'creating it..',
+                               {'name': self._destination.container_name})
+            driver.create_container(
+                container_name=self._destination.container_name)
+
+    def migrate(self):
+        """
+        Copy all the objects in the source manifest (or the source container
+        listing if there is no manifest) which don't exist at the destination
+        and then upload the manifest to the destination.
+        """
+        name = '%s:%s:%s' % (self._source.container_name,
+                             self._destination.provider_cls.name,
+                             self._destination.container_name)
+        digest = hashlib.md5(name).hexdigest()
+        lock_file_path = os.path.join(self._cache_path, digest)
+
+        with FileLock(lock_file_path, timeout=None):
+            time_start = time.time()
+
+            if (self._server_side_copy and
+                    self._source.is_same_account(self._destination)):
+                driver = self._source.get_driver(logger=self._logger)
+                self._copy_extension = get_extension(driver=driver)
+
+            source_files = self._create_run()
+            destination_files = self._create_run()
+            self._migrated = self._create_run()
+
+            try:
+                source_files.extend(self._iter_source_files())
+                destination_files.extend(self._iter_destination_files())
+                self._migrate(source_files=source_files,
+                              destination_files=destination_files)
+            finally:
+                source_files.close()
+                destination_files.close()
+                self._migrated.close()
+
+            took = (time.time() - time_start)
+            self._logger.info('Migration complete, took: %(took)0.2f' +
+                              ' seconds', {'took': took})
+
+    def _migrate(self, source_files, destination_files):
+        differences = iter_differences(local_records=source_files,
+                                       remote_records=destination_files)
+
+        pool = None
+        copy_count = 0
+        skip_count = 0
+
+        try:
+            for _, source_item, destination_item in differences:
+                if source_item is None:
+                    # Object only exists at the destination
+                    continue
+
+                # Objects are only skipped if the content is known to be the
+                # same, size alone is not enough
+                if (destination_item is not None and
+                        source_item.md5_hash and destination_item.md5_hash and
+                        source_item.matches(destination_item)):
+                    self._migrated.add(source_item)
+                    skip_count += 1
+                    continue
+
+                if pool is None:
+                    pool = self._get_pool()
+
+                func = lambda item: self._copy_object(item=item, pool=pool)
+                pool.spawn(func, source_item)
+                copy_count += 1
+
+            self._logger.info('To copy: %(to_copy)s, already present: ' +
+                              '%(present)s', {'to_copy': copy_count,
+                                              'present': skip_count})
+
+            if pool is not None:
+                pool.join()
+        finally:
+            if pool is not None:
+                pool.close()
+
+        self._upload_manifest(iterator=iter_manifest_chunks(self._migrated))
+
+    def _get_pool(self):
+        self._executor_cls.prepare()
+
+        if self._buffer_budget is None:
+            # Budget uses locks which need to be created after patching
+            self._buffer_budget = BufferBudget(limit=self._max_buffer_memory)
+
+        return self._executor_cls(concurrency=self._concurrency,
+                                  logger=self._logger)
+
+    def _create_run(self):
+        return SortedRun(directory=self._cache_path,
+                         max_items=self._sort_buffer_size)
+
+    def _should_retry(self, name):
+        self._retries[name] = self._retries[name] + 1
+        return self._retries[name] <= self._retry_limit
+
+    def _clear_retry(self, name):
+        if name in self._retries:
+            del self._retries[name]
+
+    def _iter_source_files(self):
+        """
+        Return an iterator over the files in the source manifest.
+
+        If the source keyspace is partitioned, each shard is read from its own
+        manifest section (or from the single manifest if the shard doesn't
+        have a section yet). If the source container doesn't have a manifest,
+        the container listing is used instead.
+
+        Container is listed once to find the manifest sections, the listing is
+        only used if there is no manifest.
+        """
+        driver = self._source.get_driver(logger=self._logger)
+        container = self._source.get_container(driver=driver)
+        listing = self._create_run()
+        sections = {}
+
+        try:
+            for obj in driver.iterate_container_objects(container=container):
+                section = parse_manifest_section(obj.name)
+
+                if section:
+                    last_modified = parse_timestamp(
+                        (obj.extra or {}).get('last_modified'))
+                    partition = section[1:]
+                    sections[partition] = max(sections.get(partition, 0),
+                                              last_modified)
+                    continue
+
+                if not is_internal_object(obj.name):
+                    listing.add(record_from_object(obj=obj))
+
+            if sections:
+                # Sections left behind by a different shard count (or depth)
+                # are stale
+                shard_count, shard_depth = max(
+                    sections.keys(), key=lambda partition: sections[partition])
+
+                if len(sections) > 1:
+                    self._logger.warning('Source manifest has sections for ' +
+                                         'multiple shard counts, using the ' +
+                                         'most recent one: %(count)s ' +
+                                         '(depth %(depth)s)',
+                                         {'count': shard_count,
+                                          'depth': shard_depth})
+
+                items = self._iter_manifest_sections(driver=driver,
+                                                     shard_count=shard_count,
+                                                     shard_depth=shard_depth)
+            else:
+                items = self._iter_manifest_object(driver=driver,
+                                                   name=MANIFEST_FILE)
+
+                if items is None:
+                    self._logger.info('Source manifest doesn\'t exist, ' +
+                                      'using the container listing')
+                    items = listing
+
+            for item in items:
+                yield item
+        finally:
+            listing.close()
+
+    def _iter_manifest_sections(self, driver, shard_count, shard_depth):
+        for index in range(0, shard_count):
+            name = get_shard_object_name(template=MANIFEST_SHARD_FILE,
+                                         index=index, count=shard_count,
+                                         depth=shard_depth)
+            items = self._iter_manifest_object(driver=driver, name=name)
+
+            if items is None:
+                # Shard hasn't been synchronized since the keyspace has been
+                # partitioned, its files are still in the single manifest
+                items = self._iter_manifest_object(driver=driver,
+                                                   name=MANIFEST_FILE) or []
+                items = (item for item in items
+                         if get_shard(item.remote_name, shard_count,
+                                      shard_depth) == index)
+
+            for item in items:
+                yield item
+
+    def _iter_manifest_object(self, driver, name):
+        """
+        Return an iterator over the files in a source manifest object or None
+        if the object doesn't exist.
+        """
+        try:
+            obj = driver.get_object(
+                container_name=self._source.container_name, object_name=name)
+        except ObjectDoesNotExistError:
+            return None
+
+        iterator = driver.download_object_as_stream(
+            obj=obj, chunk_size=self._chunk_size)
+        return self._iter_manifest(iterator=iterator)
+
+    def _iter_destination_files(self):
+        return self._iter_objects(endpoint=self._destination)
+
+    def _iter_manifest(self, iterator):
+        try:
+            for item in iter_manifest_records(chunks=iterator):
+                yield item
+        except ValueError, e:
+            raise CorruptManifestError('Corrupted source manifest, failed ' +
+                                       'to parse it: ' + str(e))
+
+    def _iter_objects(self, endpoint):
+        driver = endpoint.get_driver(logger=self._logger)
+        container = endpoint.get_container(driver=driver)
+
+        for obj in driver.iterate_container_objects(container=container):
+            if is_internal_object(obj.name):
+                continue
+
+            yield record_from_object(obj=obj)
+
+    def _upload_manifest(self, iterator):
+        driver = self._destination.get_driver(logger=self._logger)
+        extra = {'content_type': 'application/json'}
+        container = self._destination.get_container(driver=driver)
+        driver.upload_object_via_stream(iterator=iterator, extra=extra,
+                                        container=container,
+                                        object_name=MANIFEST_FILE)
+
+    def _copy_object(self, item, pool):
+        name = item.remote_name
+
+        self._logger.debug('Copying object: %(name)s', {'name': name})
+
+        try:
+            if self._can_copy_server_side(item=item):
+                md5_hash = self._copy_server_side(name=name)
+            else:
+                md5_hash = self._copy_stream(item=item)
+        except ObjectDoesNotExistError:
+            self._logger.error('Object "%(name)s" doesn\'t exist in the ' +
+                               'source container, skipping it',
+                               {'name': name})
+            return
+        except LibcloudError, e:
+            self._logger.error('Failed to copy object "%(name)s": %(error)s',
+                               {'name': name, 'error': str(e)})
+            if self._should_retry(name):
+                self._logger.info('Retrying to copy object "%(name)s"',
+                                  {'name': name})
+                func = lambda item: self._copy_object(item=item, pool=pool)
+                pool.spawn(func, item)
+            return
+        except Exception, e:
+            self._logger.error('Failed to copy object "%(name)s": %(error)s',
+                               {'name': name, 'error': str(e)})
+            return
+
+        if md5_hash:
+            item.md5_hash = md5_hash
+
+        self._clear_retry(name)
+        self._migrated.add(item)
+        self._logger.debug('Object copied: %(name)s', {'name': name})
+
+    def _can_copy_server_side(self, item):
+        extension = self._copy_extension
+
+        if not extension or not extension.copy_object_max_size:
+            return False
+
+        return (item.size is not None and
+                item.size <= extension.copy_object_max_size)
+
+    def _copy_server_side(self, name):
+        """
+        Copy an object without downloading it. Content doesn't change so the
+        hash from the manifest is kept.
+        """
+        driver = self._source.get_driver(logger=self._logger)
+        extension = get_extension(driver=driver)
+
+        extension.copy_object(
+            container=self._source.get_container(driver=driver), name=name,
+            destination_container=self._destination.get_container(
+                driver=driver))
+        return None
+
+    def _copy_stream(self, item):
+        """
+        Stream an object from the source to the destination and return MD5
+        hash of the copied content.
+
+        Objects which fit in a single part of a multipart upload are spooled
+        and uploaded in a single request. Larger ones are downloaded in
+        part-sized chunks, so the budget accounts for the parts which are
+        buffered by the destination driver.
+        """
+        name = item.remote_name
+        source_driver = self._source.get_driver(logger=self._logger)
+        destination_driver = self._destination.get_driver(logger=self._logger)
+
+        part_size = get_multipart_part_size(driver=destination_driver)
+        stream_upload = driver_supports_streaming(driver=destination_driver)
+
+        if part_size and item.size is not None and item.size <= part_size:
+            stream_upload = False
+
+        chunk_size = self._chunk_size
+        if stream_upload and part_size:
+            chunk_size = max(chunk_size, part_size)
+
+        obj = source_driver.get_object(
+            container_name=self._source.container_name, object_name=name)
+        stream = source_driver.download_object_as_stream(
+            obj=obj, chunk_size=chunk_size)
+        iterator = StreamChunkIterator(iterator=stream,
+                                       chunk_size=chunk_size,
+                                       budget=self._buffer_budget)
+
+        content_type = (obj.extra or {}).get('content_type', None)
+        extra = {'content_type': content_type or 'application/octet-stream'}
+        container = self._destination.get_container(driver=destination_driver)
+
+        try:
+            if stream_upload:
+                copied = destination_driver.upload_object_via_stream(
+                    iterator=iterator, container=container, object_name=name,
+                    extra=extra)
+            else:
+                copied = self._upload_spooled(driver=destination_driver,
+                                              iterator=iterator,
+                                              container=container, name=name,
+                                              extra=extra)
+        finally:
+            iterator.close()
+
+        md5_hash = iterator.md5_hash
+
+        if md5_hash is None:
+            raise LibcloudError('Upload finished before the whole object ' +
+                                'has been read', driver=destination_driver)
+
+        for expected in [item.md5_hash, get_object_md5_hash(copied)]:
+            if expected and expected != md5_hash:
+                raise ObjectHashMismatchError(
+                    value='MD5 hash checksum does not match',
+                    object_name=name, driver=destination_driver)
+
+        return md5_hash
+
+    def _upload_spooled(self, driver, iterator, container, name, extra):
+        """
+        Write the stream to a temporary file in the cache directory and upload
+        the file. This is used for the drivers which would otherwise read the
+        whole stream in memory before uploading it and for the objects which
+        are too small for a multipart upload.
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self._cache_path,
+                                         prefix='.migrate.')
+
+        try:
+            fp = os.fdopen(fd, 'wb')
+
+            try:
+                for chunk in iterator:
+                    fp.write(chunk)
+            finally:
+                fp.close()
+
+            return driver.upload_object(file_path=temp_path,
+                                        container=container,
+                                        object_name=name, extra=extra,
+                                        verify_hash=True)
+        finally:
+            os.unlink(temp_path)
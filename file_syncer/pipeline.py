@@ -0,0 +1,106 @@
+# Licensed to Tomaz Muraus under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Tomaz muraus licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Building blocks for overlapping the manifest download with the local walk.
+
+Background tasks run in a plain thread (and not in the executor pool) so
+starting one doesn't require the executor backend to be prepared and e.g.
+gevent monkey patching is still only done once there is something to
+transfer.
+"""
+
+import sys
+import threading
+
+__all__ = [
+    'BackgroundTask',
+    'prefetch'
+]
+
+
+class BackgroundTask(object):
+    """
+    Function call which runs in a background thread.
+    """
+
+    def __init__(self, func):
+        self._result = None
+        self._error = None
+        self._thread = threading.Thread(target=self._run, args=(func,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def ready(self):
+        """
+        Return True if the call has finished.
+        """
+        return not self._thread.is_alive()
+
+    def result(self):
+        """
+        Wait for the call to finish and return its result (or raise its
+        exception).
+        """
+        self._thread.join()
+
+        if self._error:
+            raise self._error[0], self._error[1], self._error[2]
+
+        return self._result
+
+    def _run(self, func):
+        try:
+            self._result = func()
+        except BaseException:
+            self._error = sys.exc_info()
+
+
+def prefetch(iterable, task, max_items):
+    """
+    Read items from the iterable while the task is running and return an
+    iterator over all the items (read ones first, remaining ones are read
+    lazily).
+
+    @param max_items: Maximum number of items which are read ahead.
+    @type max_items: C{int}
+    """
+    iterator = iter(iterable)
+    items = []
+    error = None
+
+    while len(items) < max_items and not task.ready():
+        try:
+            items.append(next(iterator))
+        except StopIteration:
+            break
+        except Exception:
+            # Raised once the consumer gets to it, so the caller can still
+            # wait for the task and clean up its result
+            error = sys.exc_info()
+            break
+
+    return _iter_prefetched(items=items, error=error, iterator=iterator)
+
+
+def _iter_prefetched(items, error, iterator):
+    for item in items:
+        yield item
+
+    if error:
+        raise error[0], error[1], error[2]
+
+    for item in iterator:
+        yield item
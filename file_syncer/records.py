@@ -0,0 +1,314 @@
+# Licensed to Tomaz Muraus under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Tomaz muraus licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+import time
+import calendar
+import posixpath
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+__all__ = [
+    'FileRecord',
+    'record_from_object',
+    'get_object_md5_hash',
+    'parse_timestamp',
+    'manifest_object_hook',
+    'iter_manifest_chunks',
+    'iter_manifest_records'
+]
+
+WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+
+TIMESTAMP_FORMATS = [
+    '%Y-%m-%dT%H:%M:%S',
+    '%a, %d %b %Y %H:%M:%S GMT'
+]
+
+
+class FileRecord(object):
+    """
+    Compact representation of a local file or a manifest entry.
+
+    Only the remote name is stored, file name and local path are derived from
+    it when needed. The same remote name string is also used as a key in the
+    file dictionaries so it's only stored once per file.
+    """
+
+    __slots__ = ('remote_name', 'last_modified', 'md5_hash', 'size')
+
+    def __init__(self, remote_name, last_modified, md5_hash=None, size=None):
+        self.remote_name = remote_name
+        self.last_modified = last_modified
+        self.md5_hash = md5_hash
+        self.size = size
+
+    @property
+    def name(self):
+        return posixpath.basename(self.remote_name)
+
+    @classmethod
+    def from_dict(cls, values):
+        md5_hash = values.get('md5_hash', None)
+
+        if md5_hash is not None:
+            md5_hash = str(md5_hash)
+
+        return cls(remote_name=_encode(values['remote_name']),
+                   last_modified=values['last_modified'],
+                   md5_hash=md5_hash, size=values.get('size', None))
+
+    def to_dict(self):
+        return {'remote_name': self.remote_name,
+                'last_modified': self.last_modified,
+                'md5_hash': self.md5_hash, 'size': self.size}
+
+    def matches(self, other):
+        """
+        Return True if both records describe the same content. Attributes
+        which are not known on either side are ignored.
+        """
+        if (self.size is not None and other.size is not None and
+                self.size != other.size):
+            return False
+
+        if (self.md5_hash and other.md5_hash and
+                self.md5_hash != other.md5_hash):
+            return False
+
+        return True
+
+    def __eq__(self, other):
+        if not isinstance(other, FileRecord):
+            return False
+
+        return self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return ('<FileRecord: remote_name=%s, last_modified=%s, size=%s>' %
+                (self.remote_name, self.last_modified, self.size))
+
+
+def record_from_object(obj):
+    """
+    Return a manifest entry for an object from the container listing.
+    """
+    extra = obj.extra or {}
+    last_modified = parse_timestamp(extra.get('last_modified'))
+
+    return FileRecord(remote_name=_encode(obj.name),
+                      last_modified=last_modified,
+                      md5_hash=get_object_md5_hash(obj=obj), size=obj.size)
+
+
+def get_object_md5_hash(obj):
+    """
+    Return MD5 hash of an object or None if the object hash is not a MD5
+    hash of the content (e.g. multipart upload ETag).
+    """
+    if not obj.hash:
+        return None
+
+    value = str(obj.hash).strip('"').lower()
+
+    if len(value) != 32:
+        return None
+
+    return value
+
+
+def parse_timestamp(value):
+    """
+    Parse a timestamp returned by the provider and return it as a number
+    of seconds since epoch. 0 is returned if the value can't be parsed
+    which means the local file will be treated as modified.
+    """
+    if not value:
+        return 0
+
+    value = value.strip()
+
+    if value[-1] == 'Z':
+        value = value[:-1]
+
+    if 'T' in value and '.' in value:
+        # Strip fractional seconds
+        value = value[:value.index('.')]
+
+    for timestamp_format in TIMESTAMP_FORMATS:
+        try:
+            parsed = time.strptime(value, timestamp_format)
+        except ValueError:
+            continue
+
+        return calendar.timegm(parsed)
+
+    return 0
+
+
+def manifest_object_hook(values):
+    """
+    JSON object hook which turns manifest entries into FileRecord instances
+    as soon as they are parsed so the whole manifest never needs to be held
+    in memory as dictionaries.
+
+    The top level object is re-keyed by the record remote names so each name
+    is only stored once.
+    """
+    remote_name = values.get('remote_name', None)
+
+    if isinstance(remote_name, basestring) and 'last_modified' in values:
+        return FileRecord.from_dict(values)
+
+    if values and isinstance(values.itervalues().next(), FileRecord):
+        return dict([(record.remote_name, record)
+                     for record in values.itervalues()])
+
+    return values
+
+
+def iter_manifest_records(chunks):
+    """
+    Incrementally parse a manifest from an iterator which yields chunks of
+    data and yield the manifest entries as FileRecord instances.
+
+    Only a single entry (and the unparsed remainder of the current chunk) is
+    held in memory at a time.
+
+    @raise ValueError: If the manifest is not valid.
+    """
+    decoder = json.JSONDecoder(object_hook=manifest_object_hook)
+    chunks = iter(chunks)
+
+    state = {'buf': '', 'pos': 0, 'eof': False}
+
+    def read():
+        # Read more data, return False if there is no more data
+        if state['eof']:
+            return False
+
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            state['eof'] = True
+            return False
+
+        state['buf'] = state['buf'][state['pos']:] + chunk
+        state['pos'] = 0
+        return True
+
+    def skip_whitespace():
+        while True:
+            match = WHITESPACE_RE.match(state['buf'], state['pos'])
+            state['pos'] = match.end()
+
+            if state['pos'] < len(state['buf']) or not read():
+                return
+
+    def expect(characters):
+        skip_whitespace()
+
+        if state['pos'] >= len(state['buf']):
+            raise ValueError('Unexpected end of manifest')
+
+        character = state['buf'][state['pos']]
+
+        if character not in characters:
+            raise ValueError('Expected one of "%s", got "%s" at position %s' %
+                             (characters, character, state['pos']))
+
+        state['pos'] += 1
+        return character
+
+    def decode():
+        skip_whitespace()
+
+        while True:
+            try:
+                value, end = decoder.raw_decode(state['buf'], state['pos'])
+            except ValueError:
+                if not read():
+                    raise
+                continue
+
+            if end == len(state['buf']) and read():
+                # Value might have been cut off (e.g. a number)
+                continue
+
+            state['pos'] = end
+            return value
+
+    expect('{')
+
+    skip_whitespace()
+    if state['buf'][state['pos']:state['pos'] + 1] == '}':
+        return
+
+    while True:
+        decode()
+        expect(':')
+        record = decode()
+
+        if not isinstance(record, FileRecord):
+            raise ValueError('Invalid manifest entry: %s' % (record))
+
+        yield record
+
+        if expect(',}') == '}':
+            return
+
+
+def _encode(value):
+    """
+    Return UTF-8 encoded byte string for the provided value. Names of the
+    local files are byte strings and encoded strings use less memory than
+    the unicode ones.
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+
+    return value
+
+
+def iter_manifest_chunks(records, chunk_size=64 * 1024):
+    """
+    Serialize an iterable of records as a manifest and return an iterator
+    which yields the manifest in chunks of roughly chunk_size bytes.
+    """
+    buf = ['{']
+    buf_size = 1
+    separator = ''
+
+    for record in records:
+        entry = '%s%s: %s' % (separator, json.dumps(record.remote_name),
+                              json.dumps(record.to_dict()))
+        separator = ', '
+
+        buf.append(entry)
+        buf_size += len(entry)
+
+        if buf_size >= chunk_size:
+            yield ''.join(buf)
+            buf = []
+            buf_size = 0
+
+    buf.append('}')
+    yield ''.join(buf)
@@ -18,27 +18,74 @@ import logging
 
 from optparse import OptionParser
 
-from libcloud.storage.providers import get_driver
-from libcloud.storage.types import Provider
-
 from file_syncer.log import get_logger
 from file_syncer.constants import VALID_LOG_LEVELS
-from file_syncer.syncer import FileSyncer
+from file_syncer.constants import DEFAULT_CHUNK_SIZE
+from file_syncer.constants import DEFAULT_MAX_BUFFER_MEMORY
+from file_syncer.constants import DEFAULT_SORT_BUFFER_SIZE
+from file_syncer.constants import DEFAULT_SCAN_QUEUE_SIZE
+from file_syncer.constants import DEFAULT_DUPLICATES_MODE
+from file_syncer.constants import DEFAULT_LEASE_TTL
+from file_syncer.constants import DEFAULT_SHARD_DEPTH
+from file_syncer.constants import DEFAULT_BACKEND
+from file_syncer.constants import DEFAULT_HEDGE_PERCENTILE
+from file_syncer.constants import DEFAULT_HEDGE_BUDGET
+from file_syncer.constants import DEFAULT_HEDGE_MAX_SIZE
+from file_syncer.executors import BACKENDS, get_executor_class
+from file_syncer.links import LINK_MODES
 
-SUPPORTED_PROVIDERS = [p for p in Provider.__dict__.keys() if not
-                       p.startswith('__')]
-PROVIDER_MAP = dict([(k, v) for k, v in Provider.__dict__.iteritems()
-                     if not k.startswith('__')])
 REQUIRED_OPTIONS = [('username', 'api_username'), ('key', 'api_key'),
-                    ('container-name', 'container_name'),
-                    ('directory', 'directory')]
+                    ('container-name', 'container_name')]
+
+# Options which are only required when not migrating a container
+REQUIRED_SYNC_OPTIONS = [('directory', 'directory')]
+
+# Providers which are bundled with file syncer and registered with Libcloud
+# when they are used
+BUNDLED_PROVIDERS = {
+    'SIMULATOR': ('file_syncer.simulator', 'SimulatedStorageDriver')
+}
+
+
+def get_supported_providers():
+    from libcloud.storage.types import Provider
+
+    return sorted([p for p in Provider.__dict__.keys() if not
+                   p.startswith('__')] + BUNDLED_PROVIDERS.keys())
+
+
+def get_provider(name):
+    """
+    Return Libcloud provider constant for the provided provider name.
+
+    Only the provider types are imported here, provider driver module is
+    imported later by get_driver.
+    """
+    from libcloud.storage.types import Provider
+
+    if name in BUNDLED_PROVIDERS:
+        from libcloud.storage.providers import DRIVERS, set_driver
+
+        if name not in DRIVERS:
+            module, klass = BUNDLED_PROVIDERS[name]
+            set_driver(name, module, klass)
+
+        return name
+
+    if name.startswith('__') or not hasattr(Provider, name):
+        raise ValueError('Invalid provider: %s. Valid providers are: %s' %
+                         (name, ', '.join(get_supported_providers())))
+
+    return getattr(Provider, name)
 
 
 def run():
     usage = 'usage: %prog --username=<api username> --key=<api key> [options]'
     parser = OptionParser(usage=usage)
     parser.add_option('--provider', dest='provider', default='CLOUDFILES_US',
-                      help='Provider to use')
+                      help='Provider to use (SIMULATOR uses a simulated ' +
+                           'provider which stores objects in the directory ' +
+                           'specified by --username)')
     parser.add_option('--region', dest='region', default=None,
                       help='Region to use if a Libcloud driver supports \
                         multiple regions (e.g. ORD for CloudFiles provider)')
@@ -48,6 +95,36 @@ def run():
                       help='API key')
     parser.add_option('--restore', dest='restore', action="store_true",
                       help='Restore from')
+    parser.add_option('--migrate', dest='migrate', action='store_true',
+                      default=False,
+                      help='Copy objects and the manifest from the ' +
+                           'container to the destination container without ' +
+                           'storing them on the local disk')
+    parser.add_option('--destination-provider', dest='destination_provider',
+                      default=None,
+                      help='Provider of the destination container ' +
+                           '(defaults to --provider)')
+    parser.add_option('--destination-region', dest='destination_region',
+                      default=None,
+                      help='Region of the destination container ' +
+                           '(defaults to --region)')
+    parser.add_option('--destination-username',
+                      dest='destination_api_username', default=None,
+                      help='API username for the destination provider ' +
+                           '(defaults to --username)')
+    parser.add_option('--destination-key', dest='destination_api_key',
+                      default=None,
+                      help='API key for the destination provider ' +
+                           '(defaults to --key)')
+    parser.add_option('--destination-container-name',
+                      dest='destination_container_name', default=None,
+                      help='Name of the container the objects are migrated ' +
+                           'to')
+    parser.add_option('--no-server-side-copy', dest='server_side_copy',
+                      default=True, action='store_false',
+                      help='Always stream objects through this host when ' +
+                           'migrating, even if both containers belong to ' +
+                           'the same provider account')
     parser.add_option('--container-name', dest='container_name',
                       default='file_syncer',
                       help='Name of the container storing the files')
@@ -59,6 +136,87 @@ def run():
                            'files are stored')
     parser.add_option('--concurrency', dest='concurrency', default=10,
                       help='File upload concurrency')
+    parser.add_option('--backend', dest='backend', default=DEFAULT_BACKEND,
+                      type='choice', choices=sorted(BACKENDS.keys()),
+                      help='Backend which is used to run the uploads, ' +
+                           'downloads and deletes in parallel (%s)' %
+                           (', '.join(sorted(BACKENDS.keys()))))
+    parser.add_option('--hedge', dest='hedge', action='store_true',
+                      default=False,
+                      help='Start a duplicate transfer if a transfer of ' +
+                           'a small object takes longer than most of the ' +
+                           'transfers and use the one which finishes first')
+    parser.add_option('--hedge-percentile', dest='hedge_percentile',
+                      default=DEFAULT_HEDGE_PERCENTILE,
+                      help='Transfers which take longer than this ' +
+                           'percentile of the recent transfers are hedged')
+    parser.add_option('--hedge-budget', dest='hedge_budget',
+                      default=DEFAULT_HEDGE_BUDGET,
+                      help='Maximum number of hedged transfers as a ' +
+                           'fraction of all the transfers')
+    parser.add_option('--hedge-max-size', dest='hedge_max_size',
+                      default=DEFAULT_HEDGE_MAX_SIZE,
+                      help='Only transfers of the objects up to this size ' +
+                           '(in bytes) are hedged')
+    parser.add_option('--duplicates', dest='duplicates',
+                      default=DEFAULT_DUPLICATES_MODE, type='choice',
+                      choices=LINK_MODES + ['none'],
+                      help='How files with the same content are restored ' +
+                           'after the content has been downloaded once ' +
+                           '(reflink, hardlink, copy). Files are copied if ' +
+                           'the file system doesn\'t support links. ' +
+                           'none downloads each file')
+    parser.add_option('--chunk-size', dest='chunk_size',
+                      default=DEFAULT_CHUNK_SIZE,
+                      help='Size of a chunk (in bytes) which is read from a ' +
+                           'file and sent over the wire')
+    parser.add_option('--max-buffer-memory', dest='max_buffer_memory',
+                      default=DEFAULT_MAX_BUFFER_MEMORY,
+                      help='Maximum amount of memory (in bytes) used by ' +
+                           'all the in-flight upload buffers')
+    parser.add_option('--sort-buffer-size', dest='sort_buffer_size',
+                      default=DEFAULT_SORT_BUFFER_SIZE,
+                      help='Maximum number of file entries which are sorted ' +
+                           'in memory before they are spilled to a ' +
+                           'temporary file in the cache directory')
+    parser.add_option('--scan-queue-size', dest='scan_queue_size',
+                      default=DEFAULT_SCAN_QUEUE_SIZE,
+                      help='Maximum number of local file entries which are ' +
+                           'read ahead while the manifest is being ' +
+                           'downloaded')
+    parser.add_option('--shard-count', dest='shard_count', default=1,
+                      help='Number of shards the keyspace is partitioned ' +
+                           'into. Each shard is synchronized by a separate ' +
+                           'worker process. Files are assigned to shards ' +
+                           'by their first --shard-depth path components, ' +
+                           'so files under a single directory at that depth ' +
+                           'are always synchronized by the same worker. ' +
+                           'Sharded runs don\'t update the single manifest, ' +
+                           'use --reconcile when going back to a single ' +
+                           'worker')
+    parser.add_option('--shard-index', dest='shard_index', default=None,
+                      help='Index of the shard (0 to shard count - 1) which ' +
+                           'is synchronized by this worker. If not ' +
+                           'specified, all the shards are restored')
+    parser.add_option('--shard-depth', dest='shard_depth',
+                      default=DEFAULT_SHARD_DEPTH,
+                      help='Number of leading path components by which the ' +
+                           'keyspace is partitioned. Increase it if most ' +
+                           'of the files are in a single top level ' +
+                           'directory (default: %d)' % (DEFAULT_SHARD_DEPTH))
+    parser.add_option('--worker-id', dest='worker_id', default=None,
+                      help='Worker identifier which is stored in the shard ' +
+                           'lease (defaults to <hostname>:<pid>)')
+    parser.add_option('--lease-ttl', dest='lease_ttl',
+                      default=DEFAULT_LEASE_TTL,
+                      help='Number of seconds after which a shard lease ' +
+                           'of a worker which has died expires')
+    parser.add_option('--path', dest='paths', action='append',
+                      default=None,
+                      help='Only synchronize or restore files in this ' +
+                           'subtree or matching this glob pattern (relative ' +
+                           'to the directory). Can be specified multiple ' +
+                           'times')
     parser.add_option('--exclude', dest='exclude',
                       help='Comma separated list of file name patterns to ' +
                            'exclude')
@@ -67,6 +225,25 @@ def run():
     parser.add_option('--delete', dest='delete', action='store_true',
                       help='delete extraneous files from dest containers',
                       default=False)
+    parser.add_option('--plan', dest='plan', action='store_true',
+                      default=False,
+                      help='Print the actions which would be performed, ' +
+                           'the totals and the estimated duration without ' +
+                           'transferring anything')
+    parser.add_option('--reconcile', dest='reconcile', action='store_true',
+                      default=False,
+                      help='Rebuild the manifest from the container listing ' +
+                           'before synchronizing. Use this if the manifest ' +
+                           'is missing, corrupted or out of date')
+    parser.add_option('--no-bulk-delete', dest='bulk_delete',
+                      default=True, action='store_false',
+                      help='Don\'t use provider bulk delete API to remove ' +
+                           'extraneous files, remove them one by one')
+    parser.add_option('--no-rename-detection', dest='detect_renames',
+                      default=True, action='store_false',
+                      help='Don\'t detect renamed and moved files, upload ' +
+                           'them instead of copying the removed files with ' +
+                           'the same content server side')
     parser.add_option('--auto-content-type', dest='auto_content_type',
                       default=False, action='store_true',
                       help='Don\'t automatically specify \'application/' +
@@ -80,16 +257,30 @@ def run():
 
     (options, args) = parser.parse_args()
 
-    for option_name, key in REQUIRED_OPTIONS:
+    required_options = REQUIRED_OPTIONS
+
+    if options.migrate:
+        required_options = required_options + \
+            [('destination-container-name', 'destination_container_name')]
+    else:
+        required_options = required_options + REQUIRED_SYNC_OPTIONS
+
+    for option_name, key in required_options:
         if not getattr(options, key, None):
             raise ValueError('Missing required argument: ' + option_name)
 
-    # Set up provider
-    if options.provider not in SUPPORTED_PROVIDERS:
-        raise ValueError('Invalid provider: %s. Valid providers are: %s' %
-                         (options.provider, ', '.join(SUPPORTED_PROVIDERS)))
+    if options.plan and (options.restore or options.migrate):
+        raise ValueError('--plan option can only be used when synchronizing')
+
+    try:
+        get_executor_class(options.backend)
+    except ValueError, e:
+        parser.error(str(e))
 
-    provider = PROVIDER_MAP[options.provider]
+    # Set up provider
+    provider = get_provider(options.provider)
+    destination_provider = get_provider(options.destination_provider or
+                                        options.provider)
 
     # Set up logger
     log_level = options.log_level.upper()
@@ -102,10 +293,23 @@ def run():
     level = getattr(logging, log_level, 'INFO')
     logger = get_logger(handler=logging.StreamHandler(), level=level)
 
+    if options.migrate:
+        migrate(options=options, provider=provider,
+                destination_provider=destination_provider, logger=logger)
+        return
+
     directory = os.path.expanduser(options.directory)
     exclude_patterns = options.exclude or ''
     exclude_patterns = exclude_patterns.split(',')
 
+    shard_index = options.shard_index
+    if shard_index is not None:
+        shard_index = int(shard_index)
+
+    # Heavy modules are only imported once the options have been validated
+    from libcloud.storage.providers import get_driver
+    from file_syncer.syncer import FileSyncer
+
     syncer = FileSyncer(directory=directory,
                         provider_cls=get_driver(provider),
                         provider=provider,
@@ -117,9 +321,59 @@ def run():
                         exclude_patterns=exclude_patterns,
                         logger=logger,
                         concurrency=int(options.concurrency),
-                        no_content_type=options.no_content_type,
-                        ignore_symlinks=options.ignore_symlinks)
+                        auto_content_type=options.auto_content_type,
+                        ignore_symlinks=options.ignore_symlinks,
+                        bulk_delete=options.bulk_delete,
+                        chunk_size=int(options.chunk_size),
+                        max_buffer_memory=int(options.max_buffer_memory),
+                        sort_buffer_size=int(options.sort_buffer_size),
+                        scan_queue_size=int(options.scan_queue_size),
+                        shard_count=int(options.shard_count),
+                        shard_index=shard_index,
+                        shard_depth=int(options.shard_depth),
+                        worker_id=options.worker_id,
+                        lease_ttl=int(options.lease_ttl),
+                        backend=options.backend,
+                        detect_renames=options.detect_renames,
+                        hedge=options.hedge,
+                        hedge_percentile=float(options.hedge_percentile),
+                        hedge_budget=float(options.hedge_budget),
+                        hedge_max_size=int(options.hedge_max_size),
+                        duplicates=options.duplicates)
     if options.restore:
-        syncer.restore()
+        syncer.restore(paths=options.paths)
+    elif options.plan:
+        syncer.plan(delete=options.delete, reconcile=options.reconcile,
+                    paths=options.paths)
     else:
-        syncer.sync(options.delete)
+        syncer.sync(delete=options.delete, reconcile=options.reconcile,
+                    paths=options.paths)
+
+
+def migrate(options, provider, destination_provider, logger):
+    from libcloud.storage.providers import get_driver
+    from file_syncer.migrator import StorageEndpoint, ContainerMigrator
+
+    source = StorageEndpoint(provider_cls=get_driver(provider),
+                             provider=provider, region=options.region,
+                             username=options.api_username,
+                             api_key=options.api_key,
+                             container_name=options.container_name)
+    destination = StorageEndpoint(
+        provider_cls=get_driver(destination_provider),
+        provider=destination_provider,
+        region=options.destination_region or options.region,
+        username=options.destination_api_username or options.api_username,
+        api_key=options.destination_api_key or options.api_key,
+        container_name=options.destination_container_name)
+
+    migrator = ContainerMigrator(
+        source=source, destination=destination,
+        cache_path=options.cache_path, logger=logger,
+        concurrency=int(options.concurrency),
+        server_side_copy=options.server_side_copy,
+        chunk_size=int(options.chunk_size),
+        max_buffer_memory=int(options.max_buffer_memory),
+        sort_buffer_size=int(options.sort_buffer_size),
+        backend=options.backend)
+    migrator.migrate()
@@ -0,0 +1,282 @@
+# Licensed to Tomaz Muraus under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Tomaz muraus licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+import time
+import hashlib
+import threading
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from libcloud.storage.base import Container, Object
+from libcloud.storage.types import ObjectDoesNotExistError
+from libcloud.utils.files import exhaust_iterator
+
+from file_syncer.exceptions import LeaseError
+from file_syncer.constants import MANIFEST_FILE
+from file_syncer.constants import SHARD_DEPTH_SUFFIX
+from file_syncer.constants import DEFAULT_SHARD_DEPTH
+
+__all__ = [
+    'get_shard',
+    'get_shard_object_name',
+    'is_internal_object',
+    'parse_manifest_section',
+    'ShardLease'
+]
+
+INTERNAL_OBJECT_RE = re.compile(
+    r'^(manifest|lease)\.\d+-of-\d+(\.depth-\d+)?\.json$')
+MANIFEST_SECTION_RE = re.compile(
+    r'^manifest\.(\d+)-of-(\d+)(?:\.depth-(\d+))?\.json$')
+
+
+def get_shard(remote_name, shard_count, depth=DEFAULT_SHARD_DEPTH):
+    """
+    Return index of the shard the provided file belongs to.
+
+    Keyspace is partitioned by the hash of the first depth path components,
+    so each directory at that depth belongs to a single shard as a whole and
+    a worker only needs to walk the directories of its own shard. Files
+    which are less deep are assigned by their whole path.
+    """
+    if shard_count == 1:
+        return 0
+
+    prefix = '/'.join(remote_name.lstrip('/').split('/')[:depth])
+
+    if isinstance(prefix, unicode):
+        prefix = prefix.encode('utf-8')
+
+    return int(hashlib.md5(prefix).hexdigest()[:8], 16) % shard_count
+
+
+def get_shard_object_name(template, index, count,
+                          depth=DEFAULT_SHARD_DEPTH):
+    """
+    Return name of a manifest section or a lease object of a shard.
+
+    Depth is only included in the name if it's not the default, so the
+    objects of a keyspace which is partitioned by the top level path
+    component keep their names.
+    """
+    suffix = ''
+
+    if depth != DEFAULT_SHARD_DEPTH:
+        suffix = SHARD_DEPTH_SUFFIX % {'depth': depth}
+
+    return template % {'index': index, 'count': count, 'suffix': suffix}
+
+
+def is_internal_object(name):
+    """
+    Return True if the object is a manifest or a lease and not a synchronized
+    file.
+    """
+    return name == MANIFEST_FILE or bool(INTERNAL_OBJECT_RE.match(name))
+
+
+def parse_manifest_section(name):
+    """
+    Return (shard index, shard count, shard depth) tuple for a manifest
+    section object or None if the object is not a manifest section.
+    """
+    match = MANIFEST_SECTION_RE.match(name)
+
+    if not match:
+        return None
+
+    depth = int(match.group(3) or DEFAULT_SHARD_DEPTH)
+    return int(match.group(1)), int(match.group(2)), depth
+
+
+class ShardLease(object):
+    """
+    Lease based lock on a shard which is stored as an object in the
+    container so it works across processes and hosts.
+
+    Lease is valid for ttl seconds and it's renewed by a background thread
+    and every time heartbeat is called. Object storage doesn't support
+    conditional writes so after writing the lease, it's read back after
+    a short delay to detect a concurrent writer. Lease is also read before
+    it's renewed, so a worker which has stalled for longer than the ttl
+    notices that another worker has taken over the shard.
+    """
+
+    def __init__(self, get_driver, container_name, object_name, owner, ttl,
+                 logger, settle_delay=1):
+        self.object_name = object_name
+        self.owner = owner
+        self.ttl = ttl
+        self.is_acquired = False
+        self.is_lost = False
+
+        self._get_driver = get_driver
+        self._container_name = container_name
+        self._logger = logger
+        self._settle_delay = settle_delay
+        self._renewed = 0
+        self._lock = None
+        self._stop = None
+
+    def acquire(self):
+        lease = self._read()
+
+        if (lease and lease.get('owner') != self.owner and
+                lease.get('expires', 0) > time.time()):
+            raise LeaseError('Shard lease %s is held by %s' %
+                             (self.object_name, lease.get('owner')))
+
+        self._write()
+        time.sleep(self._settle_delay)
+
+        lease = self._read()
+        if not lease or lease.get('owner') != self.owner:
+            raise LeaseError(('Shard lease %s has been acquired by another ' +
+                              'worker') % (self.object_name))
+
+        self.is_acquired = True
+        self.is_lost = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+        thread = threading.Thread(target=self._renew_loop)
+        thread.daemon = True
+        thread.start()
+
+        self._logger.info('Acquired shard lease %(name)s',
+                          {'name': self.object_name})
+
+    def heartbeat(self, force=False):
+        """
+        Renew the lease if more than a third of the ttl has passed since it
+        was last renewed (or if force is True).
+
+        L{LeaseError} is raised if the lease has been taken over by another
+        worker.
+        """
+        self._check_lost()
+
+        if not self.is_acquired:
+            return
+
+        if not force and time.time() - self._renewed < (self.ttl / 3.0):
+            return
+
+        self._lock.acquire()
+        try:
+            if self.is_acquired:
+                lease = self._read()
+
+                if lease and lease.get('owner') == self.owner:
+                    self._write()
+                else:
+                    self.is_acquired = False
+                    self.is_lost = True
+                    self._stop.set()
+        finally:
+            self._lock.release()
+
+        self._check_lost()
+
+    def release(self):
+        if not self.is_acquired:
+            return
+
+        self._stop.set()
+
+        self._lock.acquire()
+        try:
+            self.is_acquired = False
+            lease = self._read()
+
+            if lease and lease.get('owner') == self.owner:
+                driver = self._get_driver()
+                driver.delete_object(obj=self._get_object(driver=driver))
+        finally:
+            self._lock.release()
+
+        self._logger.info('Released shard lease %(name)s',
+                          {'name': self.object_name})
+
+    def __enter__(self):
+        if not self.is_acquired:
+            self.acquire()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+    def _renew_loop(self):
+        interval = self.ttl / 6.0
+
+        while not self._stop.is_set():
+            self._stop.wait(interval)
+
+            try:
+                self.heartbeat()
+            except LeaseError, e:
+                # Synchronization is stopped by the next heartbeat of the
+                # worker
+                self._logger.error(str(e))
+                return
+            except Exception, e:
+                self._logger.error('Failed to renew shard lease %(name)s: ' +
+                                   '%(error)s', {'name': self.object_name,
+                                                 'error': str(e)})
+
+    def _check_lost(self):
+        if self.is_lost:
+            raise LeaseError(('Shard lease %s has been acquired by another ' +
+                              'worker') % (self.object_name))
+
+    def _get_object(self, driver):
+        container = Container(name=self._container_name, extra={},
+                              driver=driver)
+        return Object(name=self.object_name, size=None, hash=None, extra=None,
+                      meta_data=None, container=container, driver=driver)
+
+    def _read(self):
+        driver = self._get_driver()
+
+        try:
+            obj = driver.get_object(container_name=self._container_name,
+                                    object_name=self.object_name)
+        except ObjectDoesNotExistError:
+            return None
+
+        iterator = driver.download_object_as_stream(obj=obj)
+
+        try:
+            return json.loads(exhaust_iterator(iterator=iterator))
+        except ValueError:
+            return None
+
+    def _write(self):
+        driver = self._get_driver()
+        now = time.time()
+        data = json.dumps({'owner': self.owner, 'expires': now + self.ttl})
+
+        container = Container(name=self._container_name, extra={},
+                              driver=driver)
+        extra = {'content_type': 'application/json'}
+        driver.upload_object_via_stream(iterator=iter([data]),
+                                        container=container,
+                                        object_name=self.object_name,
+                                        extra=extra)
+        self._renewed = now
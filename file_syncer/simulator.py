@@ -0,0 +1,569 @@
+# Licensed to Tomaz Muraus under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Tomaz muraus licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Simulated storage provider for load and failure testing.
+
+Containers and objects are stored in a local directory and each request is
+delayed, throttled or failed according to the simulation settings, so the
+provider behaviour can be reproduced without a network.
+
+Driver is selected using SIMULATOR provider. Username is a path to the
+directory where the containers are stored and API key contains comma
+separated simulation settings (e.g. "latency=0.05,error_rate=0.01"):
+
+* latency - number of seconds added to each request
+* jitter - maximum number of random seconds added on top of the latency
+* bandwidth - transfer speed of each upload and download in bytes per second
+* rate_limit - number of requests per second after which the requests are
+  throttled (503 response)
+* error_rate - fraction of the requests which fail (500 response)
+* seed - random seed which makes the injected delays and errors reproducible
+
+State which is shared between the requests (rate limit window, random number
+generator) is shared between all the driver instances in the process which
+use the same directory and settings.
+"""
+
+import os
+import time
+import random
+import shutil
+import hashlib
+import tempfile
+import threading
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from libcloud.common.types import LibcloudError, ProviderError
+from libcloud.storage.base import StorageDriver, Container, Object
+from libcloud.storage.types import ContainerAlreadyExistsError
+from libcloud.storage.types import ContainerDoesNotExistError
+from libcloud.storage.types import ContainerIsNotEmptyError
+from libcloud.storage.types import InvalidContainerNameError
+from libcloud.storage.types import ObjectDoesNotExistError
+
+__all__ = [
+    'DEFAULT_SETTINGS',
+    'SimulatedStorageDriver',
+    'parse_settings'
+]
+
+DEFAULT_SETTINGS = {
+    'latency': 0.0,
+    'jitter': 0.0,
+    'bandwidth': 0,
+    'rate_limit': 0,
+    'error_rate': 0.0,
+    'seed': None
+}
+
+# Number of objects returned by a single container listing request
+LIST_PAGE_SIZE = 1000
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+_states = {}
+_states_lock = threading.Lock()
+
+
+def parse_settings(value):
+    """
+    Parse simulation settings from a comma separated list of name=value
+    pairs.
+
+    @rtype: C{dict}
+    """
+    settings = DEFAULT_SETTINGS.copy()
+
+    for item in (value or '').split(','):
+        item = item.strip()
+
+        if not item:
+            continue
+
+        name, _, setting = item.partition('=')
+        name = name.strip()
+
+        if name not in DEFAULT_SETTINGS or not setting.strip():
+            raise ValueError('Invalid simulator setting: %s. Valid settings ' %
+                             (item) + 'are: %s' %
+                             (', '.join(sorted(DEFAULT_SETTINGS.keys()))))
+
+        if name == 'seed':
+            settings[name] = int(setting)
+        else:
+            settings[name] = float(setting)
+
+    return settings
+
+
+class SimulatorState(object):
+    """
+    State which is shared between the driver instances.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.random = random.Random(settings['seed'])
+
+        self._lock = threading.Lock()
+        self._window_start = 0
+        self._window_requests = 0
+
+    def get_delay(self):
+        latency = self.settings['latency']
+        jitter = self.settings['jitter']
+
+        if jitter:
+            self._lock.acquire()
+            try:
+                latency += self.random.uniform(0, jitter)
+            finally:
+                self._lock.release()
+
+        return latency
+
+    def should_fail(self):
+        error_rate = self.settings['error_rate']
+
+        if not error_rate:
+            return False
+
+        self._lock.acquire()
+        try:
+            return self.random.random() < error_rate
+        finally:
+            self._lock.release()
+
+    def is_throttled(self):
+        """
+        Count a request in the current one second window and return True if
+        the rate limit has been exceeded.
+        """
+        rate_limit = self.settings['rate_limit']
+
+        if not rate_limit:
+            return False
+
+        now = time.time()
+
+        self._lock.acquire()
+        try:
+            if now - self._window_start >= 1:
+                self._window_start = now
+                self._window_requests = 0
+
+            self._window_requests += 1
+            return self._window_requests > rate_limit
+        finally:
+            self._lock.release()
+
+
+def _get_state(root, settings):
+    key = (root, tuple(sorted(settings.items())))
+
+    _states_lock.acquire()
+    try:
+        if key not in _states:
+            _states[key] = SimulatorState(settings=settings)
+
+        return _states[key]
+    finally:
+        _states_lock.release()
+
+
+class SimulatedStorageDriver(StorageDriver):
+    """
+    Storage driver which stores objects in a local directory and simulates
+    latency, bandwidth limits, throttling and errors.
+    """
+
+    name = 'Simulator'
+    website = 'https://github.com/Kami/python-file-syncer'
+    supports_chunked_encoding = True
+
+    def __init__(self, key, secret=None, secure=True, host=None, port=None,
+                 **kwargs):
+        # Nothing is sent over the network so no connection is created
+        self.key = key
+        self.secret = secret
+        self.root = os.path.abspath(os.path.expanduser(key))
+        self.settings = parse_settings(secret)
+        self._state = _get_state(root=self.root, settings=self.settings)
+
+    def iterate_containers(self):
+        self._request()
+
+        if not os.path.isdir(self.root):
+            return
+
+        for name in sorted(os.listdir(self.root)):
+            if os.path.isdir(os.path.join(self.root, name)):
+                yield Container(name=name, extra={}, driver=self)
+
+    def get_container(self, container_name):
+        self._request()
+        return self._get_container(container_name=container_name)
+
+    def create_container(self, container_name):
+        self._request()
+        path = self._get_container_path(container_name)
+
+        if os.path.exists(path):
+            raise ContainerAlreadyExistsError(value=None, driver=self,
+                                              container_name=container_name)
+
+        os.makedirs(path)
+        return Container(name=container_name, extra={}, driver=self)
+
+    def delete_container(self, container):
+        self._request()
+        self._get_container(container_name=container.name)
+
+        for _ in self._iter_metadata(container=container):
+            raise ContainerIsNotEmptyError(value=None, driver=self,
+                                           container_name=container.name)
+
+        shutil.rmtree(self._get_container_path(container.name))
+        return True
+
+    def iterate_container_objects(self, container):
+        self._request()
+        self._get_container(container_name=container.name)
+
+        metadata = sorted(self._iter_metadata(container=container),
+                          key=lambda values: values['name'])
+
+        for index, values in enumerate(metadata):
+            if index and index % LIST_PAGE_SIZE == 0:
+                # Each page is a separate request
+                self._request()
+
+            yield self._to_object(container=container, values=values)
+
+    def get_object(self, container_name, object_name):
+        self._request()
+        container = self._get_container(container_name=container_name)
+        return self._get_object(container=container, object_name=object_name)
+
+    def upload_object(self, file_path, container, object_name, extra=None,
+                      verify_hash=True):
+        fp = open(file_path, 'rb')
+
+        try:
+            iterator = iter(lambda: fp.read(64 * 1024), '')
+            return self.upload_object_via_stream(iterator=iterator,
+                                                 container=container,
+                                                 object_name=object_name,
+                                                 extra=extra)
+        finally:
+            fp.close()
+
+    def upload_object_via_stream(self, iterator, container, object_name,
+                                 extra=None):
+        self._request()
+        self._get_container(container_name=container.name)
+
+        data_path, metadata_path = self._get_object_paths(container.name,
+                                                          object_name)
+        dirname = os.path.dirname(data_path)
+
+        if not os.path.exists(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                # Created by a concurrent upload
+                pass
+
+        fd, temp_path = tempfile.mkstemp(dir=dirname, prefix='.upload.')
+        md5 = hashlib.md5()
+        size = 0
+
+        try:
+            fp = os.fdopen(fd, 'wb')
+
+            try:
+                for chunk in iterator:
+                    self._transfer(len(chunk))
+                    md5.update(chunk)
+                    fp.write(chunk)
+                    size += len(chunk)
+            finally:
+                fp.close()
+
+            os.rename(temp_path, data_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+        extra = extra or {}
+        values = {'name': self._decode(object_name), 'size': size,
+                  'hash': md5.hexdigest(),
+                  'last_modified': time.strftime(TIMESTAMP_FORMAT,
+                                                 time.gmtime()),
+                  'content_type': extra.get('content_type', None),
+                  'meta_data': extra.get('meta_data', {})}
+        self._write_metadata(path=metadata_path, values=values)
+
+        return self._to_object(container=container, values=values)
+
+    def download_object(self, obj, destination_path, overwrite_existing=False,
+                        delete_on_failure=True):
+        if os.path.exists(destination_path) and not overwrite_existing:
+            raise LibcloudError(value='File %s already exists, but ' %
+                                (destination_path) + 'overwrite_existing=' +
+                                'False', driver=self)
+
+        iterator = self.download_object_as_stream(obj=obj)
+        fp = open(destination_path, 'wb')
+
+        try:
+            try:
+                for chunk in iterator:
+                    fp.write(chunk)
+            finally:
+                fp.close()
+        except BaseException:
+            if delete_on_failure and os.path.exists(destination_path):
+                os.unlink(destination_path)
+            raise
+
+        return True
+
+    def download_object_as_stream(self, obj, chunk_size=None):
+        self._request()
+        data_path, _ = self._get_object_paths(obj.container.name, obj.name)
+
+        try:
+            fp = open(data_path, 'rb')
+        except IOError:
+            raise ObjectDoesNotExistError(value=None, driver=self,
+                                          object_name=obj.name)
+
+        return self._iter_file(fp=fp, chunk_size=chunk_size or 64 * 1024)
+
+    def delete_object(self, obj):
+        self._request()
+        self._delete_object(container_name=obj.container.name,
+                            object_name=obj.name)
+        return True
+
+    def ex_copy_object(self, container, name, destination_container,
+                       destination_name=None):
+        """
+        Copy an object server side (no bandwidth limit is applied).
+        """
+        self._request()
+        obj = self._get_object(container=container, object_name=name)
+        destination_name = destination_name or name
+
+        self._get_container(container_name=destination_container.name)
+        data_path, _ = self._get_object_paths(container.name, name)
+        destination_data_path, destination_metadata_path = \
+            self._get_object_paths(destination_container.name,
+                                   destination_name)
+        dirname = os.path.dirname(destination_data_path)
+
+        if not os.path.exists(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                pass
+
+        fd, temp_path = tempfile.mkstemp(dir=dirname, prefix='.copy.')
+        os.close(fd)
+        shutil.copyfile(data_path, temp_path)
+        os.rename(temp_path, destination_data_path)
+
+        values = {'name': self._decode(destination_name), 'size': obj.size,
+                  'hash': obj.hash,
+                  'last_modified': time.strftime(TIMESTAMP_FORMAT,
+                                                 time.gmtime()),
+                  'content_type': obj.extra.get('content_type', None),
+                  'meta_data': obj.meta_data}
+        self._write_metadata(path=destination_metadata_path, values=values)
+
+    def ex_bulk_delete(self, container, names):
+        """
+        Delete multiple objects using a single request.
+
+        @return: A dictionary with an error message for each object which
+                 couldn't be deleted.
+        @rtype: C{dict}
+        """
+        self._request()
+        self._get_container(container_name=container.name)
+
+        for name in names:
+            try:
+                self._delete_object(container_name=container.name,
+                                    object_name=name)
+            except ObjectDoesNotExistError:
+                pass
+
+        return {}
+
+    def _request(self):
+        """
+        Simulate a request round trip. Request is delayed and fails if it's
+        throttled or if an error should be injected.
+        """
+        delay = self._state.get_delay()
+
+        if delay:
+            time.sleep(delay)
+
+        if self._state.is_throttled():
+            raise ProviderError(value='Simulated throttling response: 503 ' +
+                                'Slow Down', http_code=503, driver=self)
+
+        if self._state.should_fail():
+            raise ProviderError(value='Simulated error response: 500 ' +
+                                'Internal Server Error', http_code=500,
+                                driver=self)
+
+    def _transfer(self, size):
+        """
+        Simulate a transfer of size bytes.
+        """
+        bandwidth = self.settings['bandwidth']
+
+        if bandwidth and size:
+            time.sleep(size / float(bandwidth))
+
+    def _iter_file(self, fp, chunk_size):
+        try:
+            while True:
+                chunk = fp.read(chunk_size)
+
+                if not chunk:
+                    break
+
+                self._transfer(len(chunk))
+                yield chunk
+        finally:
+            fp.close()
+
+    def _get_container(self, container_name):
+        if not os.path.isdir(self._get_container_path(container_name)):
+            raise ContainerDoesNotExistError(value=None, driver=self,
+                                             container_name=container_name)
+
+        return Container(name=container_name, extra={}, driver=self)
+
+    def _get_object(self, container, object_name):
+        _, metadata_path = self._get_object_paths(container.name, object_name)
+
+        try:
+            fp = open(metadata_path, 'rb')
+        except IOError:
+            raise ObjectDoesNotExistError(value=None, driver=self,
+                                          object_name=object_name)
+
+        try:
+            values = json.loads(fp.read())
+        finally:
+            fp.close()
+
+        return self._to_object(container=container, values=values)
+
+    def _delete_object(self, container_name, object_name):
+        data_path, metadata_path = self._get_object_paths(container_name,
+                                                          object_name)
+
+        try:
+            os.unlink(metadata_path)
+        except OSError:
+            raise ObjectDoesNotExistError(value=None, driver=self,
+                                          object_name=object_name)
+
+        os.unlink(data_path)
+
+    def _get_container_path(self, container_name):
+        if (not container_name or '/' in container_name or
+                container_name in ['.', '..']):
+            raise InvalidContainerNameError(value=None, driver=self,
+                                            container_name=container_name)
+
+        return os.path.join(self.root, container_name)
+
+    def _get_object_paths(self, container_name, object_name):
+        """
+        Return paths of the object data and metadata files.
+
+        Object names can't be mapped to the local paths directly (e.g. "a"
+        and "a/b" can both exist) so the files are named by a hash of the
+        object name.
+        """
+        digest = hashlib.md5(self._encode(object_name)).hexdigest()
+        path = os.path.join(self._get_container_path(container_name),
+                            digest[:2], digest)
+        return path, path + '.json'
+
+    def _iter_metadata(self, container):
+        path = self._get_container_path(container.name)
+
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                if not filename.endswith('.json'):
+                    continue
+
+                try:
+                    fp = open(os.path.join(dirpath, filename), 'rb')
+                except IOError:
+                    # Deleted while listing
+                    continue
+
+                try:
+                    yield json.loads(fp.read())
+                finally:
+                    fp.close()
+
+    def _write_metadata(self, path, values):
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                         prefix='.metadata.')
+        fp = os.fdopen(fd, 'wb')
+
+        try:
+            fp.write(json.dumps(values))
+        finally:
+            fp.close()
+
+        os.rename(temp_path, path)
+
+    def _to_object(self, container, values):
+        extra = {'last_modified': values['last_modified'],
+                 'content_type': values.get('content_type', None)}
+        return Object(name=values['name'], size=values['size'],
+                      hash=values['hash'], extra=extra,
+                      meta_data=values.get('meta_data', None) or {},
+                      container=container, driver=self)
+
+    def _encode(self, value):
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+
+        return value
+
+    def _decode(self, value):
+        if isinstance(value, str):
+            return value.decode('utf-8')
+
+        return value
@@ -0,0 +1,237 @@
+# Licensed to Tomaz Muraus under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Tomaz muraus licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import mmap
+import hashlib
+import threading
+
+__all__ = [
+    'BufferBudget',
+    'FileChunkIterator',
+    'StreamChunkIterator'
+]
+
+
+class BufferBudget(object):
+    """
+    Global cap on the amount of memory used by the in-flight transfer buffers.
+
+    Each stream needs to reserve space for a chunk before it reads it and
+    releases it once the consumer asks for the next chunk. If the budget is
+    exhausted, the stream blocks until some other stream releases its chunk.
+    """
+
+    def __init__(self, limit):
+        if limit <= 0:
+            raise ValueError('Buffer memory limit must be a positive number')
+
+        self.limit = limit
+        self._used = 0
+        self._condition = threading.Condition()
+
+    @property
+    def used(self):
+        return self._used
+
+    def acquire(self, size):
+        size = min(size, self.limit)
+
+        self._condition.acquire()
+        try:
+            while self._used + size > self.limit:
+                self._condition.wait()
+
+            self._used += size
+        finally:
+            self._condition.release()
+
+        return size
+
+    def release(self, size):
+        self._condition.acquire()
+        try:
+            self._used -= size
+            self._condition.notify_all()
+        finally:
+            self._condition.release()
+
+
+class FileChunkIterator(object):
+    """
+    Iterator which reads a local file in fixed-size chunks and calculates MD5
+    hash of the data in the same pass.
+
+    If possible, the file is memory-mapped so each chunk is copied only once
+    directly from the page cache. Empty files and files which can't be mapped
+    fall back to plain fixed-size reads.
+
+    Memory used by a chunk which has been handed to the consumer is accounted
+    for in the budget until the next chunk is requested or the iterator is
+    closed.
+    """
+
+    def __init__(self, file_path, chunk_size, budget=None, use_mmap=True):
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.bytes_read = 0
+
+        self._budget = budget
+        self._use_mmap = use_mmap
+        self._hash = hashlib.md5()
+        self._file = None
+        self._map = None
+        self._reserved = 0
+        self._done = False
+
+    @property
+    def md5_hash(self):
+        """
+        MD5 hash of the file content. Only available once the whole file has
+        been consumed.
+        """
+        if not self._done:
+            return None
+
+        return self._hash.hexdigest()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        self._release()
+
+        if self._done:
+            raise StopIteration()
+
+        if self._file is None:
+            self._open()
+
+        if self._budget:
+            self._reserved = self._budget.acquire(self.chunk_size)
+
+        if self._map is not None:
+            offset = self.bytes_read
+            chunk = self._map[offset:offset + self.chunk_size]
+        else:
+            chunk = self._file.read(self.chunk_size)
+
+        if not chunk:
+            self.close()
+            self._done = True
+            raise StopIteration()
+
+        self.bytes_read += len(chunk)
+        self._hash.update(chunk)
+        return chunk
+
+    __next__ = next
+
+    def close(self):
+        self._release()
+
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open(self):
+        self._file = open(self.file_path, 'rb')
+
+        if not self._use_mmap:
+            return
+
+        size = os.fstat(self._file.fileno()).st_size
+
+        if size == 0:
+            # Empty files can't be memory-mapped
+            return
+
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except (mmap.error, ValueError, EnvironmentError):
+            self._map = None
+
+    def _release(self):
+        if self._reserved and self._budget:
+            self._budget.release(self._reserved)
+
+        self._reserved = 0
+
+
+class StreamChunkIterator(object):
+    """
+    Iterator which passes through chunks of a remote object download stream
+    and calculates MD5 hash of the data in the same pass.
+
+    Space for a chunk is reserved in the budget before the chunk is read from
+    the source and released once the consumer asks for the next chunk, the
+    same way as in L{FileChunkIterator}.
+    """
+
+    def __init__(self, iterator, chunk_size, budget=None):
+        self.chunk_size = chunk_size
+        self.bytes_read = 0
+
+        self._iterator = iter(iterator)
+        self._budget = budget
+        self._hash = hashlib.md5()
+        self._reserved = 0
+        self._done = False
+
+    @property
+    def md5_hash(self):
+        if not self._done:
+            return None
+
+        return self._hash.hexdigest()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        self._release()
+
+        if self._done:
+            raise StopIteration()
+
+        if self._budget:
+            self._reserved = self._budget.acquire(self.chunk_size)
+
+        try:
+            chunk = next(self._iterator)
+        except StopIteration:
+            self.close()
+            self._done = True
+            raise
+
+        self.bytes_read += len(chunk)
+        self._hash.update(chunk)
+        return chunk
+
+    __next__ = next
+
+    def close(self):
+        self._release()
+
+    def _release(self):
+        if self._reserved and self._budget:
+            self._budget.release(self._reserved)
+
+        self._reserved = 0
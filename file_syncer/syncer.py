@@ -13,33 +13,111 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import sys
 import time
 import os
+import socket
+import binascii
 import hashlib
-import copy
 import fnmatch
+import threading
 
-from StringIO import StringIO
-from itertools import chain
+from itertools import chain, groupby
 from collections import defaultdict
 
-try:
-    import simplejson as json
-except ImportError:
-    import json
-
-from gevent import monkey
-from gevent.pool import Pool
-from libcloud.utils.files import exhaust_iterator
 from libcloud.storage.base import Container, Object
 from libcloud.storage.types import ContainerDoesNotExistError
 from libcloud.storage.types import ObjectDoesNotExistError
+from libcloud.storage.types import ObjectHashMismatchError
 from libcloud.common.types import LibcloudError
 
-monkey.patch_all()
-
 from file_syncer.file_lock import FileLock
+from file_syncer.exceptions import CorruptManifestError
+from file_syncer.sharding import ShardLease, get_shard, is_internal_object
+from file_syncer.sharding import get_shard_object_name
+from file_syncer.extensions import get_extension
+from file_syncer.executors import get_executor_class
+from file_syncer.hedging import Hedger
+from file_syncer.history import ThroughputHistory
+from file_syncer.links import LINK_MODES, link_file
+from file_syncer.pipeline import BackgroundTask, prefetch
+from file_syncer.records import FileRecord, record_from_object
+from file_syncer.records import get_object_md5_hash
+from file_syncer.records import iter_manifest_chunks, iter_manifest_records
+from file_syncer.diff import SortedRun, RenameDetector, sort_key
+from file_syncer.diff import content_key
+from file_syncer.diff import iter_differences
+from file_syncer.streaming import BufferBudget, FileChunkIterator
 from file_syncer.constants import MANIFEST_FILE
+from file_syncer.constants import MANIFEST_SHARD_FILE
+from file_syncer.constants import LEASE_SHARD_FILE
+from file_syncer.constants import THROUGHPUT_HISTORY_FILE
+from file_syncer.constants import DEFAULT_LEASE_TTL
+from file_syncer.constants import DEFAULT_SHARD_DEPTH
+from file_syncer.constants import DEFAULT_BACKEND
+from file_syncer.constants import DEFAULT_HEDGE_PERCENTILE
+from file_syncer.constants import DEFAULT_HEDGE_BUDGET
+from file_syncer.constants import DEFAULT_HEDGE_MAX_SIZE
+from file_syncer.constants import DEFAULT_CHUNK_SIZE
+from file_syncer.constants import DEFAULT_MAX_BUFFER_MEMORY
+from file_syncer.constants import MIN_MULTIPART_PART_SIZE
+from file_syncer.constants import DEFAULT_SORT_BUFFER_SIZE
+from file_syncer.constants import DEFAULT_SCAN_QUEUE_SIZE
+from file_syncer.constants import DEFAULT_DUPLICATES_MODE
+
+# Characters which mark a path component as a glob pattern
+GLOB_CHARACTERS = '*?['
+
+# Maps provider names to the driver arguments which force a region
+PROVIDER_HAS_REGION = {
+    'cloudfiles_us': 'ex_force_service_region',
+    'cloudfiles_uk': 'ex_force_service_region'
+}
+
+
+def get_driver_instance(provider_cls, username, api_key, logger,
+                        provider=None, region=None):
+    """
+    Return a new driver instance for the provided credentials.
+    """
+    args = (username, api_key)
+    kwargs = {}
+
+    force_region = PROVIDER_HAS_REGION.get(provider, None)
+    if region and force_region:
+        kwargs[force_region] = region
+
+        logger.debug('Forcing region: %(region)s', {'region': region})
+
+    driver = provider_cls(*args, **kwargs)
+    return driver
+
+
+def driver_supports_streaming(driver):
+    """
+    Return True if the driver can upload a stream without first reading it
+    all in memory.
+    """
+    return (getattr(driver, 'supports_chunked_encoding', False) or
+            getattr(driver, 'supports_s3_multipart_upload', False))
+
+
+def get_multipart_part_size(driver):
+    """
+    Return size of the parts in which the driver splits a streamed upload
+    (None if the driver doesn't use multipart uploads).
+
+    Parts are buffered by libcloud, so a stream which is passed to such driver
+    needs to be read in chunks of (at least) this size for the buffer budget
+    to account for them.
+    """
+    if (getattr(driver, 'supports_chunked_encoding', False) or
+            not getattr(driver, 'supports_s3_multipart_upload', False)):
+        return None
+
+    # Drivers which support multipart uploads extend the S3 driver
+    s3 = sys.modules.get('libcloud.storage.drivers.s3')
+    return max(getattr(s3, 'CHUNK_SIZE', 0), MIN_MULTIPART_PART_SIZE)
 
 
 class FileSyncer(object):
@@ -47,7 +125,20 @@ class FileSyncer(object):
                  container_name, cache_path, exclude_patterns,
                  logger, provider=None, region=None,
                  concurrency=20, retry_limit=3,
-                 auto_content_type=False, ignore_symlinks=False):
+                 auto_content_type=False, ignore_symlinks=False,
+                 bulk_delete=True,
+                 chunk_size=DEFAULT_CHUNK_SIZE,
+                 max_buffer_memory=DEFAULT_MAX_BUFFER_MEMORY,
+                 sort_buffer_size=DEFAULT_SORT_BUFFER_SIZE,
+                 scan_queue_size=DEFAULT_SCAN_QUEUE_SIZE,
+                 shard_count=1, shard_index=None,
+                 shard_depth=DEFAULT_SHARD_DEPTH, worker_id=None,
+                 lease_ttl=DEFAULT_LEASE_TTL, backend=DEFAULT_BACKEND,
+                 detect_renames=True, hedge=False,
+                 hedge_percentile=DEFAULT_HEDGE_PERCENTILE,
+                 hedge_budget=DEFAULT_HEDGE_BUDGET,
+                 hedge_max_size=DEFAULT_HEDGE_MAX_SIZE,
+                 duplicates=DEFAULT_DUPLICATES_MODE):
         self._directory = directory
         self._provider_cls = provider_cls
         self._provider = provider
@@ -63,14 +154,51 @@ class FileSyncer(object):
         self._retries = defaultdict(int)
         self._auto_content_type = auto_content_type
         self._ignore_symlinks = ignore_symlinks
+        self._bulk_delete = bulk_delete
+        self._chunk_size = min(chunk_size, max_buffer_memory)
+        self._max_buffer_memory = max_buffer_memory
+        self._buffer_budget = None
+        self._sort_buffer_size = sort_buffer_size
+        self._scan_queue_size = scan_queue_size
+        self._shard_count = shard_count
+        self._shard_index = shard_index
+        self._shard_depth = shard_depth
+        self._worker_id = worker_id or '%s:%s' % (socket.gethostname(),
+                                                  os.getpid())
+        self._lease_ttl = lease_ttl
+        self._lease = None
+        self._executor_cls = get_executor_class(backend)
+        self._detect_renames = detect_renames
+        self._copy_object_max_size = None
+        self._hedge = hedge
+        self._hedge_percentile = hedge_percentile
+        self._hedge_budget = hedge_budget
+        self._hedge_max_size = hedge_max_size
+        self._hedger = None
+        self._duplicates = duplicates
+        self._duplicate_stats = defaultdict(int)
+        self._duplicate_stats_lock = None
 
         self._uploaded = []
         self._removed = []
+        self._drift = None
+        self._manifest_outdated = False
 
         if not os.path.exists(self._directory):
             raise ValueError('Directory %s doesn\'t exist' %
                              (self._directory))
 
+        if self._shard_count < 1:
+            raise ValueError('Shard count must be a positive number')
+
+        if (self._shard_index is not None and
+                not 0 <= self._shard_index < self._shard_count):
+            raise ValueError('Shard index must be between 0 and %s' %
+                             (self._shard_count - 1))
+
+        if self._shard_depth < 1:
+            raise ValueError('Shard depth must be a positive number')
+
         self._logger.info('Using provider: %(name)s',
                           {'name': provider_cls.name})
 
@@ -104,24 +232,33 @@ class FileSyncer(object):
 
         self._container = container
 
-    def _get_driver_instance(self):
-        PROVIDER_HAS_REGION = {
-            'cloudfiles_us': 'ex_force_service_region',
-            'cloudfiles_uk': 'ex_force_service_region'
-        }
+    def _get_pool(self):
+        """
+        Return an executor which is used to perform the remote operations in
+        parallel (see L{file_syncer.executors}).
+        """
+        self._executor_cls.prepare()
 
-        args = (self._username, self._api_key)
-        kwargs = {}
+        if self._buffer_budget is None:
+            # Budget uses locks which need to be created after patching
+            self._buffer_budget = BufferBudget(limit=self._max_buffer_memory)
 
-        force_region = PROVIDER_HAS_REGION.get(self._provider, None)
-        if self._region and force_region:
-            kwargs[force_region] = self._region
+        if self._hedge and self._hedger is None:
+            self._hedger = Hedger(executor_cls=self._executor_cls,
+                                  percentile=self._hedge_percentile,
+                                  budget=self._hedge_budget,
+                                  logger=self._logger)
 
-            self._logger.debug('Forcing region: %(region)s',
-                               {'region': self._region})
+        return self._executor_cls(concurrency=self._concurrency,
+                                  logger=self._logger)
 
-        driver = self._provider_cls(*args, **kwargs)
-        return driver
+    def _get_driver_instance(self):
+        return get_driver_instance(provider_cls=self._provider_cls,
+                                   username=self._username,
+                                   api_key=self._api_key,
+                                   logger=self._logger,
+                                   provider=self._provider,
+                                   region=self._region)
 
     def _include_file(self, file_name):
         """
@@ -133,93 +270,741 @@ class FileSyncer(object):
 
         return True
 
-    def sync(self, delete=False):
+    def sync(self, delete=False, reconcile=False, paths=None):
         """
         Synchronizes remote directory with a local one.
-        """
-        digest = hashlib.md5(self._directory).hexdigest()
-        lock_file_path = os.path.join(digest)
 
-        pool = Pool(self._concurrency)
+        Local files and remote manifest are compared as two sorted streams in
+        a single merge pass and the uploads are started as soon as the
+        differences are found, so the memory usage doesn't depend on the size
+        of the tree.
+
+        Manifest is downloaded in the background while the local directory
+        is walked (see L{_scan_local_files}). Removed files are only removed
+        after all the uploads have finished.
+
+        If reconcile is True, the manifest is rebuilt from the container
+        listing before calculating the differences (see L{reconcile}).
 
-        with FileLock(lock_file_path, timeout=None):
+        If shard count is larger than 1, only the files which belong to the
+        shard of this worker are synchronized (see L{_acquire_lease}).
+
+        If paths are provided, only the files in those subtrees (or matching
+        those glob patterns) are scanned, compared and transferred. Manifest
+        entries for the other files are kept as they are.
+        """
+        self._check_shard_index()
+        paths = self._normalize_paths(paths=paths)
+
+        with FileLock(self._get_lock_file_path(), timeout=None):
             # Ensure that only a single process runs at the same time
             time_start = time.time()
-            local_files = self._get_local_files(directory=self._directory)
-            self._logger.debug('Found %(count)s local files',
-                               {'count': len(local_files)})
+            self._acquire_lease()
 
-            remote_files = self._get_remote_files()
-            self._logger.debug('Found %(count)s remote files',
-                               {'count': len(remote_files)})
+            def run(remote_files, local_files):
+                self._uploaded = self._create_run()
 
-            differences = self._get_differences(local_files=local_files,
-                                                remote_files=remote_files)
-            actions = self._calculate_actions(differences=differences,
-                                              delete=delete)
+                try:
+                    self._sync(remote_files=remote_files,
+                               local_files=local_files, delete=delete,
+                               reconcile=reconcile, paths=paths)
+                finally:
+                    self._uploaded.close()
 
-            self._logger.info(('To remove: %(to_remove)s, ',
-                              'to upload: %(to_upload)s'),
-                              {'to_remove': len(actions['to_remove']),
-                               'to_upload': len(actions['to_upload'])})
+            try:
+                self._run_pipeline(func=run, reconcile=reconcile,
+                                   paths=paths)
+            finally:
+                self._release_lease()
 
-            # Synchronization is performed in two steps:
-            # 1 - Upload new or changed files and remove deleted ones
-            # 2 - Upload manifest
+            took = (time.time() - time_start)
+            self._logger.info('Synchronization complete, took: %(took)0.2f' +
+                              ' seconds', {'took': took})
+            self._log_hedge_stats()
 
-            for item in actions['to_remove']:
-                func = lambda item: self._remove_object(item=item, pool=pool)
-                pool.spawn(func, item)
+    def plan(self, delete=False, reconcile=False, paths=None, output=None):
+        """
+        Write actions which would be performed by L{sync} to the output (one
+        action per line as soon as it's found) followed by the totals and the
+        estimated duration, without transferring anything.
+
+        Duration is estimated as the time it took to walk the directory and
+        compare it with the manifest (which sync repeats) plus the transfer
+        time estimated from the throughput of the previous runs which is
+        stored in the cache directory. Files are not hashed, so the renamed
+        files are listed as uploads even if they would be copied server side.
+
+        @return: A dictionary with the totals.
+        @rtype: C{dict}
+        """
+        self._check_shard_index()
+        paths = self._normalize_paths(paths=paths)
+        output = output or sys.stdout
+        result = {}
 
-            for item in actions['to_upload']:
-                func = lambda item: self._upload_object(item=item, pool=pool)
-                pool.spawn(func, item)
+        time_start = time.time()
+
+        def run(remote_files, local_files):
+            result.update(self._plan(remote_files=remote_files,
+                                     local_files=local_files, delete=delete,
+                                     paths=paths, output=output,
+                                     time_start=time_start))
+
+        self._run_pipeline(func=run, reconcile=reconcile, paths=paths)
+
+        took = (time.time() - time_start)
+        self._logger.info('Planning complete, took: %(took)0.2f seconds',
+                          {'took': took})
+
+        return result
+
+    def _plan(self, remote_files, local_files, delete, paths, output,
+              time_start):
+        remote_records = remote_files
+
+        if paths:
+            remote_records = (item for item in remote_files
+                              if self._match_paths(item.remote_name, paths))
+
+        differences = iter_differences(local_records=local_files,
+                                       remote_records=remote_records)
+
+        result = {'upload_count': 0, 'upload_size': 0, 'remove_count': 0,
+                  'remove_size': 0, 'unchanged_count': 0}
+
+        for action, local_item, remote_item in differences:
+            if action in ['added', 'modified']:
+                kind, item = 'upload', local_item
+            elif action == 'removed' and delete:
+                kind, item = 'remove', remote_item
+            else:
+                if action == 'unchanged':
+                    result['unchanged_count'] += 1
+
+                continue
+
+            result[kind + '_count'] += 1
+            result[kind + '_size'] += item.size or 0
+
+            size = item.size
+            if size is None:
+                size = '-'
+
+            output.write('%s %s %s\n' % (kind, size, item.remote_name))
+
+        scan_seconds = (time.time() - time_start)
+
+        output.write('To upload: %(upload_count)s files, %(upload_size)s ' %
+                     result + 'bytes\n')
+        output.write('To remove: %(remove_count)s files, %(remove_size)s ' %
+                     result + 'bytes\n')
+        output.write('Unchanged: %(unchanged_count)s files\n' % result)
+
+        history = self._get_throughput_history()
+        transfer_seconds = None
+        unknown = []
+
+        for kind in ['upload', 'remove']:
+            estimate = history.estimate(kind=kind,
+                                        count=result[kind + '_count'],
+                                        size=result[kind + '_size'])
+
+            if estimate is None:
+                if result[kind + '_count']:
+                    unknown.append(kind)
 
+                continue
+
+            transfer_seconds = (transfer_seconds or 0.0) + estimate
+
+        if transfer_seconds is None and unknown:
+            result['estimated_duration'] = None
+            output.write('Estimated duration: unknown (no throughput has ' +
+                         'been recorded by the previous runs)\n')
+        else:
+            duration = scan_seconds + (transfer_seconds or 0.0)
+            result['estimated_duration'] = duration
+
+            runs = max(history.get_run_count(kind='upload'),
+                       history.get_run_count(kind='remove'))
+            note = ''
+
+            if unknown:
+                note = ', excluding: %s' % (', '.join(unknown))
+
+            output.write('Estimated duration: %0.2f seconds (%0.2f seconds ' %
+                         (duration, scan_seconds) + 'scanning, transfers ' +
+                         'based on %s previous runs%s)\n' % (runs, note))
+
+        output.flush()
+        return result
+
+    def _run_pipeline(self, func, reconcile, paths):
+        """
+        Download the manifest while the local directory is walked and call
+        func with the remote files run and the local files iterator.
+        """
+        func_remote = lambda: self._get_remote_run(reconcile=reconcile)
+        remote_task = BackgroundTask(func=func_remote)
+        local_files = self._scan_local_files(task=remote_task, paths=paths)
+        remote_files = remote_task.result()
+        self._logger.debug('Found %(count)s remote files',
+                           {'count': len(remote_files)})
+
+        try:
+            func(remote_files, local_files)
+        finally:
+            remote_files.close()
+
+    def _get_throughput_history(self):
+        path = os.path.join(self._cache_path, THROUGHPUT_HISTORY_FILE)
+        return ThroughputHistory(path=path)
+
+    def _record_throughput(self, kind, count, size, seconds):
+        if not count:
+            return
+
+        history = self._get_throughput_history()
+        history.record(kind=kind, count=count, size=size, seconds=seconds)
+
+    def _sync(self, remote_files, local_files, delete=False,
+              reconcile=False, paths=None):
+        remote_records = remote_files
+
+        if paths:
+            remote_records = (item for item in remote_files
+                              if self._match_paths(item.remote_name, paths))
+
+        differences = iter_differences(local_records=local_files,
+                                       remote_records=remote_records)
+
+        detector = self._get_rename_detector(remote_files=remote_files)
+        candidates = None
+
+        if detector:
+            candidates = self._create_run()
+
+        # Synchronization is performed in two steps:
+        # 1 - Upload new or changed files (or copy renamed ones) and remove
+        #     deleted ones
+        # 2 - Upload manifest
+        pool = None
+
+        try:
+            local_count = 0
+            upload_count = 0
+            upload_size = 0
+            to_remove = []
+
+            # Time spent waiting for the upload pool. The uploads run while
+            # the walk continues, so the time spent walking is not included
+            # in the recorded upload throughput (L{plan} measures it itself)
+            upload_seconds = 0.0
+
+            for action, local_item, remote_item in differences:
+                if self._lease:
+                    self._lease.heartbeat()
+
+                if local_item is not None:
+                    local_count += 1
+
+                if (action == 'added' and detector and
+                        detector.is_candidate(local_item)):
+                    # File might have been renamed, upload is postponed
+                    # until all the removed files are known
+                    candidates.add(local_item)
+                    upload_count += 1
+                    upload_size += local_item.size or 0
+                elif action in ['added', 'modified']:
+                    if pool is None:
+                        pool = self._get_pool()
+
+                    func = lambda item: self._upload_object(item=item,
+                                                            pool=pool)
+                    spawn_start = time.time()
+                    pool.spawn(func, local_item)
+                    upload_seconds += (time.time() - spawn_start)
+                    upload_count += 1
+                    upload_size += local_item.size or 0
+                elif action == 'removed':
+                    if detector:
+                        detector.add_removed(remote_item)
+
+                    if delete:
+                        to_remove.append(remote_item)
+
+            self._logger.debug('Found %(count)s local files',
+                               {'count': local_count})
+            self._logger.info('To remove: %(to_remove)s, ' +
+                              'to upload: %(to_upload)s',
+                              {'to_remove': len(to_remove),
+                               'to_upload': upload_count})
+
+            if (not to_remove and not upload_count and not reconcile and
+                    not self._manifest_outdated):
+                self._logger.info('Nothing to synchronize')
+                return
+
+            if pool is None:
+                pool = self._get_pool()
+
+            upload_start = time.time()
+
+            if candidates:
+                for item in candidates:
+                    func = lambda item: self._upload_or_copy_object(
+                        item=item, detector=detector, pool=pool)
+                    pool.spawn(func, item)
+
+            # Objects are only removed after all the uploads have finished
+            # (renamed files are copied from the removed ones)
+            pool.join()
+            upload_seconds += (time.time() - upload_start)
+            self._record_throughput(kind='upload', count=upload_count,
+                                    size=upload_size, seconds=upload_seconds)
+
+            remove_start = time.time()
+            self._remove_objects(items=to_remove, pool=pool)
             pool.join()
+            self._record_throughput(kind='remove', count=len(to_remove),
+                                    size=sum([item.size or 0
+                                              for item in to_remove]),
+                                    seconds=(time.time() - remove_start))
 
             manifest = self._generate_manifest(remote_files=remote_files)
-            self._upload_manifest(json.dumps(manifest))
+            self._upload_manifest(iterator=manifest)
+        finally:
+            if pool is not None:
+                pool.close()
+
+            if candidates is not None:
+                candidates.close()
+
+    def _get_rename_detector(self, remote_files):
+        """
+        Return a rename detector for the remote files or None if the renamed
+        files can't be copied server side and need to be uploaded.
+        """
+        if not self._detect_renames or not len(remote_files):
+            return None
+
+        extension = get_extension(driver=self._get_driver_instance())
+
+        if not extension or not extension.copy_object_max_size:
+            return None
+
+        self._copy_object_max_size = extension.copy_object_max_size
+        return RenameDetector(remote_records=remote_files)
+
+    def reconcile(self):
+        """
+        Rebuild the manifest from the container listing and upload it.
+
+        This is useful if the manifest has been lost, corrupted or it has
+        drifted from the actual container content.
+
+        @return: A dictionary with the detected drift (see
+                 L{_rebuild_manifest}).
+        """
+        self._check_shard_index()
+
+        with FileLock(self._get_lock_file_path(), timeout=None):
+            time_start = time.time()
+            self._acquire_lease()
+
+            try:
+                remote_files = self._get_remote_run(reconcile=True)
+
+                try:
+                    manifest = iter_manifest_chunks(records=remote_files)
+                    self._upload_manifest(iterator=manifest)
+                finally:
+                    remote_files.close()
+            finally:
+                self._release_lease()
 
             took = (time.time() - time_start)
-            self._logger.info('Synchronization complete, took: %(took)0.2f' +
+            self._logger.info('Reconciliation complete, took: %(took)0.2f' +
                               ' seconds', {'took': took})
 
-    def restore(self):
+        return self._drift
+
+    def restore(self, paths=None):
         """
         Restores a remote container to the file system
+
+        If shard count is larger than 1 and shard index is not specified,
+        files from all the shards are restored.
+
+        If paths are provided, only the files in those subtrees (or matching
+        those glob patterns) are restored.
+
+        Each distinct content (MD5 hash and size) is only downloaded once and
+        the other files with the same content are created locally using the
+        duplicates mode (see L{_restore_duplicates}). Files without a known
+        hash are downloaded as soon as they are found in the manifest, the
+        other ones once the whole manifest has been read.
         """
-        digest = hashlib.md5(self._directory).hexdigest()
-        lock_file_path = os.path.join(digest)
+        paths = self._normalize_paths(paths=paths)
 
-        pool = Pool(self._concurrency)
-        with FileLock(lock_file_path, timeout=None):
+        with FileLock(self._get_lock_file_path(), timeout=None):
             # Ensure that only a single process runs at the same time
             time_start = time.time()
+            pool = self._get_pool()
+            duplicates = None
 
-            for item in self._get_remote_files():
-                func = lambda item: self._download_remote_file(name=item)
-                pool.spawn(func, item)
+            if self._duplicates != 'none':
+                self._duplicate_stats_lock = threading.Lock()
+                duplicates = self._create_run(key=content_key)
 
-            pool.join()
+            func = lambda item: self._download_remote_file(
+                name=item.remote_name, size=item.size)
+
+            try:
+                for item in self._iter_remote_files():
+                    if (paths and
+                            not self._match_paths(item.remote_name, paths)):
+                        continue
+
+                    if duplicates is not None and item.md5_hash and item.size:
+                        duplicates.add(item)
+                        continue
+
+                    pool.spawn(func, item)
+
+                if duplicates is not None:
+                    for items in self._iter_content_groups(duplicates):
+                        if len(items) == 1:
+                            pool.spawn(func, items[0])
+                        else:
+                            pool.spawn(self._restore_duplicates, items)
+
+                pool.join()
+            finally:
+                pool.close()
+
+                if duplicates is not None:
+                    duplicates.close()
 
             took = (time.time() - time_start)
             self._logger.info('Synchronization complete, took: %(took)0.2f' +
                               ' seconds', {'took': took})
+            self._log_hedge_stats()
+            self._log_duplicate_stats()
+
+    def _iter_content_groups(self, records):
+        """
+        Return an iterator which yields lists of the records with the same
+        content from a run ordered by L{content_key}.
+        """
+        key = lambda record: (record.md5_hash, record.size)
+
+        for _, items in groupby(records, key=key):
+            yield list(items)
+
+    def _restore_duplicates(self, items):
+        """
+        Restore files which have the same content.
+
+        Content is downloaded once and the other files are created from the
+        downloaded file as reflinks, hardlinks or copies depending on the
+        duplicates mode. If the mode is not supported by the file system, the
+        file is copied.
+
+        If a download fails, the next file is tried as the source (and the
+        failed file is created from it). If a file can't be created from the
+        source, it's downloaded instead.
+        """
+        source = None
+        others = []
+
+        for item in items:
+            if source is not None:
+                others.append(item)
+                continue
+
+            try:
+                if self._download_remote_file(name=item.remote_name,
+                                              size=item.size):
+                    source = item
+            except Exception, e:
+                self._logger.error('Failed to download object "%(name)s": ' +
+                                   '%(error)s', {'name': item.remote_name,
+                                                 'error': str(e)})
+                others.append(item)
+
+        if source is None:
+            return
+
+        source_path = self._get_item_path(item=source)
+
+        for other in others:
+            try:
+                self._link_duplicate(source=source, item=other,
+                                     source_path=source_path)
+            except Exception, e:
+                self._logger.error('Failed to create "%(name)s" from ' +
+                                   '"%(source)s", downloading it instead: ' +
+                                   '%(error)s',
+                                   {'name': other.remote_name,
+                                    'source': source.remote_name,
+                                    'error': str(e)})
+                self._download_duplicate(item=other)
+
+    def _link_duplicate(self, source, item, source_path):
+        file_path = self._get_item_path(item=item)
+        self._create_directory(path=os.path.dirname(file_path))
+
+        method = link_file(source=source_path, destination=file_path,
+                           mode=self._duplicates)
+
+        self._logger.debug('Restored object %(name)s from %(source)s ' +
+                           'using %(method)s',
+                           {'name': item.remote_name,
+                            'source': source.remote_name,
+                            'method': method})
+
+        self._duplicate_stats_lock.acquire()
+        try:
+            self._duplicate_stats[method] += 1
+            self._duplicate_stats['bytes'] += item.size
+        finally:
+            self._duplicate_stats_lock.release()
+
+    def _download_duplicate(self, item):
+        try:
+            self._download_remote_file(name=item.remote_name, size=item.size)
+        except Exception, e:
+            self._logger.error('Failed to download object "%(name)s": ' +
+                               '%(error)s', {'name': item.remote_name,
+                                             'error': str(e)})
+
+    def _log_duplicate_stats(self):
+        stats = self._duplicate_stats
+        count = sum([stats[method] for method in LINK_MODES])
+
+        if not count:
+            return
+
+        self._logger.info('Restored %(count)s duplicate files without ' +
+                          'downloading them (%(bytes)s bytes, reflink: ' +
+                          '%(reflink)s, hardlink: %(hardlink)s, copy: ' +
+                          '%(copy)s)',
+                          {'count': count, 'bytes': stats['bytes'],
+                           'reflink': stats['reflink'],
+                           'hardlink': stats['hardlink'],
+                           'copy': stats['copy']})
+
+    def _normalize_paths(self, paths):
+        """
+        Return paths (relative to the directory) in the same format as the
+        remote names. None is returned if the paths cover the whole tree.
+        """
+        if not paths:
+            return None
+
+        result = []
+
+        for path in paths:
+            path = '/' + path.strip('/')
+
+            if path == '/':
+                return None
+
+            result.append(path)
+
+        return result
+
+    def _match_paths(self, remote_name, paths):
+        """
+        Return True if the file is located in one of the subtrees or it
+        matches one of the glob patterns.
+        """
+        for path in paths:
+            if (fnmatch.fnmatch(remote_name, path) or
+                    fnmatch.fnmatch(remote_name, path + '/*')):
+                return True
+
+        return False
+
+    def _get_path_roots(self, paths):
+        """
+        Return a list of the local paths which need to be walked to find all
+        the files matching the provided paths, ordered by L{sort_key}.
+
+        Walk starts at the longest path prefix which doesn't contain any glob
+        characters and nested roots are merged with their parents.
+        """
+        prefixes = []
+
+        for path in paths:
+            prefix = []
+
+            for part in path.strip('/').split('/'):
+                if [char for char in GLOB_CHARACTERS if char in part]:
+                    break
+
+                prefix.append(part)
+
+            prefixes.append(tuple(prefix))
+
+        roots = []
+
+        for prefix in sorted(set(prefixes)):
+            if roots and prefix[:len(roots[-1])] == roots[-1]:
+                continue
+
+            roots.append(prefix)
+
+        result = []
+
+        for prefix in roots:
+            path = os.path.join(self._directory, *prefix)
+
+            if os.path.isdir(path):
+                # Files in a sub tree are ordered after the files in the
+                # parent directory
+                key = (prefix, '')
+            else:
+                key = sort_key('/' + '/'.join(prefix))
+
+            result.append((key, prefix, path))
+
+        result.sort()
+        return [item[1:] for item in result]
+
+    def _should_hedge(self, size):
+        """
+        Return True if a transfer of an object with the provided size should
+        be hedged.
+        """
+        return (self._hedger is not None and size is not None and
+                size <= self._hedge_max_size)
+
+    def _log_hedge_stats(self):
+        if self._hedger is None:
+            return
+
+        self._logger.info('Hedged requests issued: %(issued)s, won: ' +
+                          '%(won)s', {'issued': self._hedger.issued,
+                                      'won': self._hedger.won})
+
+    def _check_shard_index(self):
+        if self._shard_count > 1 and self._shard_index is None:
+            raise ValueError('Shard index needs to be specified when ' +
+                             'shard count is larger than 1')
+
+    def _get_lock_file_path(self):
+        """
+        Return path to the local lock file which ensures that only a single
+        process works on the same directory (and shard) at the same time.
+        """
+        name = hashlib.md5(self._directory).hexdigest()
+
+        if self._shard_count > 1 and self._shard_index is not None:
+            name += '-%s-of-%s' % (self._shard_index, self._shard_count)
+
+            if self._shard_depth != DEFAULT_SHARD_DEPTH:
+                name += '-depth-%s' % (self._shard_depth)
+
+        return os.path.join(self._cache_path, name)
+
+    def _get_manifest_name(self, shard_index=None):
+        """
+        Return name of the manifest object for the provided shard (defaults to
+        the shard of this worker).
+
+        If the keyspace is partitioned, each shard has its own manifest
+        section so the workers never write to the same object.
+        """
+        if self._shard_count == 1:
+            return MANIFEST_FILE
+
+        if shard_index is None:
+            shard_index = self._shard_index
+
+        return get_shard_object_name(template=MANIFEST_SHARD_FILE,
+                                     index=shard_index,
+                                     count=self._shard_count,
+                                     depth=self._shard_depth)
+
+    def _in_shard(self, remote_name):
+        """
+        Return True if the file belongs to the shard of this worker.
+        """
+        if self._shard_count == 1 or self._shard_index is None:
+            return True
+
+        return (get_shard(remote_name, self._shard_count,
+                          self._shard_depth) == self._shard_index)
+
+    def _acquire_lease(self):
+        """
+        Acquire a lease on the shard of this worker.
+
+        Lease is stored in the container so it prevents multiple workers on
+        different hosts from working on the same shard at the same time.
+        """
+        if self._shard_count == 1:
+            return
+
+        # Lease is renewed in the background, make sure this happens in
+        # a thread (or a greenlet) which cooperates with the transfers
+        self._executor_cls.prepare()
+
+        name = get_shard_object_name(template=LEASE_SHARD_FILE,
+                                     index=self._shard_index,
+                                     count=self._shard_count,
+                                     depth=self._shard_depth)
+        self._lease = ShardLease(get_driver=self._get_driver_instance,
+                                 container_name=self._container_name,
+                                 object_name=name, owner=self._worker_id,
+                                 ttl=self._lease_ttl, logger=self._logger)
+        self._lease.acquire()
+
+    def _release_lease(self):
+        if self._lease:
+            self._lease.release()
+            self._lease = None
 
     def _get_item_remote_name(self, name, file_path):
         return file_path.replace(self._directory, '')
 
+    def _get_item_path(self, item):
+        """
+        Return local path for the provided item.
+        """
+        return os.path.join(os.path.abspath(self._directory),
+                            item.remote_name.lstrip('/'))
+
+    def _create_run(self, key=None):
+        """
+        Return a new sorted run which spills to the cache directory.
+        """
+        return SortedRun(directory=self._cache_path,
+                         max_items=self._sort_buffer_size, key=key)
+
     def _generate_manifest(self, remote_files):
-        manifest = copy.deepcopy(remote_files)
+        """
+        Return an iterator which yields a new manifest in chunks.
 
-        for item in self._uploaded:
-            manifest[item['remote_name']] = item
+        Uploaded files are merged with the sorted remote files and removed
+        files are skipped while the manifest is being serialized so the
+        remote files don't need to be copied.
+        """
+        removed = set([item.remote_name for item in self._removed])
+
+        def iter_records():
+            merged = iter_differences(local_records=self._uploaded,
+                                      remote_records=remote_files)
 
-        for item in self._removed:
-            if item['remote_name'] in manifest:
-                del manifest[item['remote_name']]
+            for _, uploaded_item, remote_item in merged:
+                if uploaded_item is not None:
+                    yield uploaded_item
+                elif remote_item.remote_name not in removed:
+                    yield remote_item
 
-        return manifest
+        return iter_manifest_chunks(records=iter_records())
 
     def _should_retry(self, name):
         self._retries[name] = self._retries[name] + 1
@@ -229,19 +1014,98 @@ class FileSyncer(object):
         if name in self._retries:
             del self._retries[name]
 
-    def _upload_manifest(self, data):
+    def _upload_manifest(self, iterator):
+        if self._lease:
+            # Manifest section is only written while the shard is still
+            # leased by this worker (raises if another worker has taken it)
+            self._lease.heartbeat(force=True)
+
         driver = self._get_driver_instance()
-        name = MANIFEST_FILE
+        name = self._get_manifest_name()
         extra = {'content_type': 'application/json'}
         container = Container(name=self._container_name, extra=None,
                               driver=driver)
-        iterator = StringIO(data)
         driver.upload_object_via_stream(iterator=iterator, extra=extra,
                                         container=container, object_name=name)
 
+    def _remove_objects(self, items, pool):
+        """
+        Remove objects using bulk delete requests if the provider supports
+        them, otherwise fall back to removing objects one by one.
+        """
+        extension = None
+
+        if self._bulk_delete and items:
+            extension = get_extension(driver=self._get_driver_instance())
+
+        if not extension or not extension.bulk_delete_batch_size:
+            for item in items:
+                func = lambda item: self._remove_object(item=item, pool=pool)
+                pool.spawn(func, item)
+
+            return
+
+        batch_size = extension.bulk_delete_batch_size
+        for index in range(0, len(items), batch_size):
+            batch = items[index:index + batch_size]
+            func = lambda batch: self._remove_batch(items=batch, pool=pool)
+            pool.spawn(func, batch)
+
+    def _remove_batch(self, items, pool):
+        """
+        Remove a batch of objects using a single bulk delete request.
+
+        Objects which couldn't be removed are retried using a regular per
+        object delete.
+        """
+        driver = self._get_driver_instance()
+        extension = get_extension(driver=driver)
+        names = [item.remote_name for item in items]
+
+        self._logger.debug('Removing %(count)s objects using bulk delete',
+                           {'count': len(names)})
+
+        container = Container(name=self._container_name, extra={},
+                              driver=driver)
+
+        try:
+            errors = extension.bulk_delete(container=container, names=names)
+        except Exception, e:
+            self._logger.error('Bulk delete of %(count)s objects failed, ' +
+                               'falling back to per object delete: ' +
+                               '%(error)s',
+                               {'count': len(names), 'error': str(e)})
+            errors = dict([(name, str(e)) for name in names])
+
+        unknown = set(errors.keys()) - set(names)
+        if unknown:
+            # Failed objects can't be told apart, so all of them are kept in
+            # the manifest and their removal is retried by the next run
+            self._logger.error('Bulk delete returned errors for unknown ' +
+                               'objects, not removing %(count)s objects ' +
+                               'from the manifest: %(names)s',
+                               {'count': len(names),
+                                'names': ', '.join(map(repr, unknown))})
+            return
+
+        for item in items:
+            name = item.remote_name
+
+            if name not in errors:
+                self._removed.append(item)
+                continue
+
+            self._logger.error('Failed to remove object "%(name)s": %(error)s',
+                               {'name': name, 'error': errors[name]})
+            func = lambda item: self._remove_object(item=item, pool=pool)
+            pool.spawn(func, item)
+
+        self._logger.debug('Removed %(count)s objects using bulk delete',
+                           {'count': len(names) - len(errors)})
+
     def _remove_object(self, item, pool):
         driver = self._get_driver_instance()
-        name = item['remote_name']
+        name = item.remote_name
 
         self._logger.debug('Removing object: %(name)s', {'name': name})
 
@@ -271,10 +1135,84 @@ class FileSyncer(object):
         self._removed.append(item)
         self._logger.debug('Object removed: %(name)s', {'name': name})
 
-    def _upload_object(self, item, pool):
+    def _upload_or_copy_object(self, item, detector, pool):
+        """
+        Copy a file server side if it has the same content as one of the
+        removed files, otherwise upload it.
+        """
+        if (detector.has_removed(item) and
+                item.size <= self._copy_object_max_size):
+            try:
+                md5_hash = self._get_file_md5_hash(item=item)
+            except (IOError, OSError), e:
+                self._logger.error('Failed to read file "%(name)s": ' +
+                                   '%(error)s', {'name': item.remote_name,
+                                                 'error': str(e)})
+                return
+
+            source_item = detector.match(record=item, md5_hash=md5_hash)
+
+            if source_item and self._copy_object(item=item,
+                                                 source_item=source_item,
+                                                 md5_hash=md5_hash):
+                return
+
+        self._upload_object(item=item, pool=pool)
+
+    def _copy_object(self, item, source_item, md5_hash):
+        """
+        Copy a remote object to a new name server side.
+
+        @return: True if the object has been copied, False otherwise.
+        @rtype: C{bool}
+        """
         driver = self._get_driver_instance()
-        name = item['remote_name']
-        file_path = item['path']
+        extension = get_extension(driver=driver)
+        name = item.remote_name
+        source_name = source_item.remote_name
+
+        self._logger.debug('Copying object: %(source)s to %(name)s',
+                           {'source': source_name, 'name': name})
+
+        container = Container(name=self._container_name, extra={},
+                              driver=driver)
+
+        try:
+            extension.copy_object(container=container, name=source_name,
+                                  destination_container=container,
+                                  destination_name=name)
+        except Exception, e:
+            self._logger.error('Failed to copy object "%(source)s" to ' +
+                               '"%(name)s", uploading it instead: %(error)s',
+                               {'source': source_name, 'name': name,
+                                'error': str(e)})
+            return False
+
+        item.md5_hash = md5_hash
+
+        self._uploaded.add(item)
+        self._logger.debug('Object copied: %(name)s', {'name': name})
+        return True
+
+    def _get_file_md5_hash(self, item):
+        """
+        Return MD5 hash of a local file.
+        """
+        iterator = FileChunkIterator(file_path=self._get_item_path(item=item),
+                                     chunk_size=self._chunk_size,
+                                     budget=self._buffer_budget)
+
+        try:
+            for _ in iterator:
+                pass
+        finally:
+            iterator.close()
+
+        return iterator.md5_hash
+
+    def _upload_object(self, item, pool):
+        name = item.remote_name
+        file_path = self._get_item_path(item=item)
 
         self._logger.debug('Uploading object: %(name)s', {'name': name})
 
@@ -282,13 +1220,20 @@ class FileSyncer(object):
         if not self._auto_content_type:
             extra['content_type'] = 'application/octet-stream'
 
-        container = Container(name=self._container_name, extra=None,
-                              driver=driver)
+        def upload():
+            # Each attempt uses its own driver (and connection)
+            driver = self._get_driver_instance()
+            container = Container(name=self._container_name, extra=None,
+                                  driver=driver)
+            return self._upload_file(driver=driver, container=container,
+                                     name=name, file_path=file_path,
+                                     extra=extra)
 
         try:
-            driver.upload_object(file_path=file_path, container=container,
-                                 object_name=name, extra=extra)
-
+            if self._should_hedge(size=item.size):
+                md5_hash = self._hedger.run(kind='upload', func=upload)
+            else:
+                md5_hash = upload()
         except LibcloudError, e:
             self._logger.error('Failed to upload object "%(name)s": %(error)s',
                                {'name': name, 'error': str(e)})
@@ -303,70 +1248,381 @@ class FileSyncer(object):
                                {'name': name, 'error': str(e)})
             return
 
+        item.md5_hash = md5_hash
+
         self._clear_retry(name)
-        self._uploaded.append(item)
+        self._uploaded.add(item)
         self._logger.debug('Object uploaded: %(name)s', {'name': name})
 
-    def _get_local_files(self, directory):
+    def _upload_file(self, driver, container, name, file_path, extra):
+        """
+        Upload a local file and return MD5 hash of the uploaded content (or
+        None if it's not known).
+
+        If the driver can stream the data, the file is read exactly once in
+        fixed-size chunks which are accounted for in the global buffer budget
+        and the hash is calculated in the same pass. For drivers which split
+        the stream in multipart upload parts a chunk is a whole part.
+
+        Drivers which would need to buffer the whole stream in memory and
+        files which fit in a single part of a multipart upload are uploaded in
+        a single request from a file path and the hash which has been verified
+        by the driver is used (None if the returned hash is not a MD5 of the
+        content).
+        """
+        part_size = get_multipart_part_size(driver=driver)
+
+        if (not driver_supports_streaming(driver=driver) or
+                (part_size and os.path.getsize(file_path) <= part_size)):
+            obj = driver.upload_object(file_path=file_path,
+                                       container=container,
+                                       object_name=name, extra=extra,
+                                       verify_hash=True)
+            return get_object_md5_hash(obj)
+
+        iterator = FileChunkIterator(file_path=file_path,
+                                     chunk_size=max(self._chunk_size,
+                                                    part_size or 0),
+                                     budget=self._buffer_budget)
+
+        try:
+            obj = driver.upload_object_via_stream(iterator=iterator,
+                                                  container=container,
+                                                  object_name=name,
+                                                  extra=extra)
+        finally:
+            iterator.close()
+
+        md5_hash = iterator.md5_hash
+
+        if md5_hash is None:
+            raise LibcloudError('Upload finished before the whole file ' +
+                                'has been read', driver=driver)
+
+        # Multipart uploads return a hash which is not a MD5 of the content
+        server_hash = get_object_md5_hash(obj)
+        if server_hash and server_hash != md5_hash:
+            raise ObjectHashMismatchError(
+                value='MD5 hash checksum does not match',
+                object_name=name, driver=driver)
+
+        return md5_hash
+
+    def _scan_local_files(self, task, paths=None):
         """
-        Recursively find all the files in a directory.
+        Walk the local directory while the task (manifest download) is
+        running and return an iterator over the found files.
 
-        @rtype C{dict}
+        The walk can get at most scan_queue_size files ahead, the rest of the
+        files are found as they are compared with the manifest. Walk runs in
+        the calling thread, so the executor backend (e.g. gevent monkey
+        patching) is still only prepared once there is something to upload.
         """
-        result = {}
+        items = self._iter_local_files(directory=self._directory, paths=paths)
+        return prefetch(iterable=items, task=task,
+                        max_items=self._scan_queue_size)
 
+    def _iter_local_files(self, directory, paths=None):
+        """
+        Recursively find all the files in a directory and yield them ordered
+        by L{sort_key}.
+
+        If paths are provided, only the subtrees which can contain the
+        matching files are walked.
+        """
+        if not paths:
+            for item in self._walk_directory(directory=directory,
+                                             path=directory):
+                yield item
+
+            return
+
+        for prefix, path in self._get_path_roots(paths=paths):
+            # Shard of a directory is only known at the shard depth, shard
+            # of a file is always known
+            if ((len(prefix) >= self._shard_depth or os.path.isfile(path)) and
+                    not self._in_shard('/'.join(prefix))):
+                continue
+
+            if os.path.isdir(path):
+                items = self._walk_directory(directory=directory, path=path)
+            elif os.path.isfile(path):
+                base_path = os.path.abspath(directory)
+                items = [self._get_local_item(base_path=base_path,
+                                              dirpath=os.path.dirname(path),
+                                              name=os.path.basename(path))]
+            else:
+                continue
+
+            for item in items:
+                if item and self._match_paths(item.remote_name, paths):
+                    yield item
+
+    def _walk_directory(self, directory, path):
         base_path = os.path.abspath(directory)
-        files = os.walk(directory, followlinks=(not self._ignore_symlinks))
+        files = os.walk(path, followlinks=(not self._ignore_symlinks))
         for (dirpath, dirnames, filenames) in files:
-            for name in filenames:
+            prefix = self._get_path_prefix(dirpath=dirpath)
 
-                file_path = os.path.join(base_path, dirpath, name)
-                remote_name = self._get_item_remote_name(name=name,
-                                                         file_path=file_path)
+            if len(prefix) < self._shard_depth:
+                # Shards are assigned by the first shard_depth path
+                # components so directories of the other shards are never
+                # visited
+                filenames = [name for name in filenames
+                             if self._in_shard('/'.join(prefix + [name]))]
 
-                if not self._include_file(remote_name):
-                    self._logger.debug('File %(name)s is excluded skipping it',
-                                       {'name': name})
-                    continue
+                if len(prefix) + 1 == self._shard_depth:
+                    dirnames[:] = [name for name in dirnames if
+                                   self._in_shard('/'.join(prefix + [name]))]
 
-                mtime = os.path.getmtime(file_path)
-                md5_hash = None
+            # Sorted listings mean the files are visited in sort_key order
+            dirnames.sort()
 
-                item = {'name': name, 'remote_name': remote_name,
-                        'path': file_path, 'last_modified': mtime,
-                        'md5_hash': md5_hash}
-                result[remote_name] = item
+            # Let the manifest download run (the walk never blocks on its own
+            # when the standard library is monkey patched by gevent)
+            time.sleep(0)
 
-        return result
+            for name in sorted(filenames):
+                item = self._get_local_item(base_path=base_path,
+                                            dirpath=dirpath, name=name)
+
+                if item:
+                    yield item
+
+    def _get_path_prefix(self, dirpath):
+        """
+        Return a list of the path components of a local directory relative
+        to the synchronized directory.
+        """
+        remote_name = self._get_item_remote_name(name=None, file_path=dirpath)
+        return [part for part in remote_name.split('/') if part]
+
+    def _get_local_item(self, base_path, dirpath, name):
+        """
+        Return a record for a local file or None if the file is excluded.
+        """
+        file_path = os.path.join(base_path, dirpath, name)
+        remote_name = self._get_item_remote_name(name=name,
+                                                 file_path=file_path)
+
+        if not self._include_file(remote_name):
+            self._logger.debug('File %(name)s is excluded skipping it',
+                               {'name': name})
+            return None
+
+        stat = os.stat(file_path)
+
+        item = FileRecord(remote_name=remote_name,
+                          last_modified=stat.st_mtime,
+                          size=stat.st_size)
+        return item
+
+    def _get_remote_run(self, reconcile=False):
+        """
+        Return files in a container as a L{SortedRun}.
+        """
+        run = self._create_run()
+
+        try:
+            run.extend(self._iter_remote_files(reconcile=reconcile))
+        except Exception:
+            run.close()
+            raise
+
+        return run
+
+    def _iter_remote_files(self, reconcile=False):
+        """
+        Return an iterator over the files in a container.
+
+        Manifest is parsed incrementally while it is being downloaded. If
+        reconcile is True, it is also merged with the container listing (see
+        L{_rebuild_manifest}).
+
+        If the keyspace is partitioned and shard index is not specified,
+        files from all the manifest sections are returned.
+        """
+        if self._shard_count == 1 or self._shard_index is not None:
+            return self._iter_manifest_files(shard_index=self._shard_index,
+                                             reconcile=reconcile)
+
+        return chain.from_iterable([self._iter_manifest_files(shard_index=i)
+                                    for i in range(0, self._shard_count)])
 
-    def _get_remote_files(self):
+    def _iter_manifest_files(self, shard_index, reconcile=False):
         """
-        Return a list of files in a container.
+        Return an iterator over the files in a single manifest object.
         """
         driver = self._get_driver_instance()
+        name = self._get_manifest_name(shard_index=shard_index)
 
         try:
             obj = driver.get_object(container_name=self._container_name,
-                                    object_name=MANIFEST_FILE)
+                                    object_name=name)
         except ObjectDoesNotExistError:
+            if name != MANIFEST_FILE:
+                # Manifest section is created on the first sharded run, use
+                # entries from the single manifest until then
+                self._manifest_outdated = True
+                items = self._iter_legacy_manifest_files(
+                    shard_index=shard_index)
+
+                if not reconcile:
+                    return items
+
+                self._logger.info('Manifest section doesn\'t exist, ' +
+                                  'rebuilding it from the single manifest ' +
+                                  'and the container listing')
+                manifest = self._load_manifest_run(items=items)
+                return self._rebuild_manifest(manifest=manifest)
+
+            if reconcile:
+                self._logger.info('Manifest doesn\'t exist, rebuilding it ' +
+                                  'from the container listing')
+                return self._rebuild_manifest(manifest=self._create_run())
+
             self._logger.debug('Manifest doesn\'t exist, assuming that ' +
                                'there are no remote files')
-            return {}
+            return iter([])
 
-        iterator = driver.download_object_as_stream(obj=obj)
-        data = exhaust_iterator(iterator=iterator)
+        chunk_size = self._chunk_size
+        iterator = driver.download_object_as_stream(obj=obj,
+                                                    chunk_size=chunk_size)
+
+        if not reconcile:
+            return self._iter_manifest(iterator=iterator)
+
+        manifest = self._load_manifest_run(
+            items=self._iter_manifest(iterator=iterator))
+        return self._rebuild_manifest(manifest=manifest)
+
+    def _load_manifest_run(self, items):
+        """
+        Return manifest entries as a L{SortedRun}. If the manifest is
+        corrupted, an empty run is returned and the manifest is rebuilt from
+        the container listing alone.
+        """
+        run = self._create_run()
 
         try:
-            parsed = json.loads(data)
-        except Exception, e:
-            raise Exception('Corrupted manifest, failed to parse it: ' +
-                            str(e))
+            run.extend(items)
+        except CorruptManifestError, e:
+            self._logger.error('%(error)s. Rebuilding it from the ' +
+                               'container listing', {'error': str(e)})
+            run.close()
+            run = self._create_run()
+        except Exception:
+            run.close()
+            raise
+
+        return run
+
+    def _iter_legacy_manifest_files(self, shard_index):
+        driver = self._get_driver_instance()
+
+        try:
+            obj = driver.get_object(container_name=self._container_name,
+                                    object_name=MANIFEST_FILE)
+        except ObjectDoesNotExistError:
+            return
+
+        chunk_size = self._chunk_size
+        iterator = driver.download_object_as_stream(obj=obj,
+                                                    chunk_size=chunk_size)
+
+        for item in self._iter_manifest(iterator=iterator):
+            shard = get_shard(item.remote_name, self._shard_count,
+                              self._shard_depth)
+
+            if shard == shard_index:
+                yield item
+
+    def _iter_manifest(self, iterator):
+        try:
+            for item in iter_manifest_records(chunks=iterator):
+                yield item
+        except ValueError, e:
+            raise CorruptManifestError('Corrupted manifest, failed to ' +
+                                       'parse it: ' + str(e))
+
+    def _rebuild_manifest(self, manifest):
+        """
+        Return an iterator over the manifest entries rebuilt from the
+        container listing.
+
+        Container listing is streamed page by page into a sorted run which is
+        then merged with the existing manifest entries (a L{SortedRun}), so
+        neither of them needs to fit in memory. Each object is compared to
+        the existing manifest entry using the size and the hash. Entries
+        which match are kept as is, other are replaced with the values from
+        the listing. Entries for objects which don't exist in the container
+        are dropped.
+
+        Once the iterator has been consumed, detected drift is available in
+        self._drift as a dictionary with the following keys:
+
+        untracked - objects which exist in the container, but not in the
+                    manifest.
+        changed - objects which size or hash doesn't match the manifest.
+        missing - manifest entries for objects which don't exist in the
+                  container.
+        """
+        driver = self._get_driver_instance()
+        container = Container(name=self._container_name, extra={},
+                              driver=driver)
+
+        listing = self._create_run()
+        count = 0
+        drift = {'untracked': [], 'changed': [], 'missing': []}
+
+        try:
+            for obj in driver.iterate_container_objects(container=container):
+                name = obj.name
+
+                if is_internal_object(name) or not self._in_shard(name):
+                    continue
+
+                listing.add(record_from_object(obj=obj))
 
-        return parsed
+            merged = iter_differences(local_records=listing,
+                                      remote_records=manifest)
 
-    def _download_remote_file(self, name):
+            for _, object_item, item in merged:
+                if object_item is None:
+                    drift['missing'].append(item.remote_name)
+                    continue
+
+                name = object_item.remote_name
+
+                if item is None:
+                    drift['untracked'].append(name)
+                    item = object_item
+                elif not item.matches(object_item):
+                    drift['changed'].append(name)
+                    item = object_item
+
+                count += 1
+                yield item
+        finally:
+            listing.close()
+            manifest.close()
+
+        self._drift = drift
+        self._logger.info('Manifest rebuilt from %(count)s objects ' +
+                          '(untracked: %(untracked)s, changed: %(changed)s, ' +
+                          'missing: %(missing)s)',
+                          {'count': count,
+                           'untracked': len(drift['untracked']),
+                           'changed': len(drift['changed']),
+                           'missing': len(drift['missing'])})
+
+    def _download_remote_file(self, name, size=None):
         """
         Download a remote file given a name.
+
+        @return: True if the file has been downloaded, False if the object
+                 doesn't exist.
+        @rtype: C{bool}
         """
 
         self._logger.debug('Downloading object: %(name)s to %(path)s',
@@ -382,65 +1638,73 @@ class FileSyncer(object):
         dirname = os.path.dirname(filepath)
 
         # make sure the path exists
-        if dirname and not os.path.exists(dirname):
-            os.makedirs(dirname)
+        if dirname:
+            self._create_directory(path=dirname)
+
+        if self._should_hedge(size=size):
+            return self._download_hedged(name=name, file_path=filepath)
 
         try:
             obj = driver.get_object(container_name=self._container_name,
                                     object_name=name)
         except ObjectDoesNotExistError:
             self._logger.debug('Object ' + name + ' doesn\'t exist')
-            return
+            return False
 
         driver.download_object(obj=obj, destination_path=filepath,
                                overwrite_existing=True,
                                delete_on_failure=True)
+        return True
 
-    def _get_differences(self, local_files, remote_files):
+    def _create_directory(self, path):
         """
-        Return differences between a local and remote copy.
-
-        @rtype C{dict} A dictionary with the following keys:
-
-        added - files which have been added locally.
-        removed - files which have been removed.
-        modified - files which have been modified.
+        Create a local directory (and its parents) if it doesn't exist yet.
         """
-        result = {'added': {}, 'removed': {}, 'modified': {}}
+        if os.path.isdir(path):
+            return
 
-        for name, local_item in local_files.iteritems():
-            remote_item = remote_files.get(name, None)
+        try:
+            os.makedirs(path)
+        except OSError:
+            # Directory might have been created by a concurrent download
+            if not os.path.isdir(path):
+                raise
 
-            if remote_item is None:
-                # New file
-                result['added'][name] = local_item
-            elif local_item['last_modified'] > remote_item['last_modified']:
-                # Local file has been modified
-                result['modified'][name] = local_item
+    def _download_hedged(self, name, file_path):
+        """
+        Download a remote file with hedging.
 
-        for name, remote_item in remote_files.iteritems():
-            name = remote_item['remote_name']
-            local_item = local_files.get(name, None)
+        Each attempt downloads the file to its own temporary file next to the
+        destination and the file downloaded by the winning attempt is moved
+        in place.
+        """
+        dirname, basename = os.path.split(file_path)
 
-            if not local_item:
-                # File has been deleted locally
-                result['removed'][name] = remote_item
+        def download():
+            driver = self._get_driver_instance()
+            obj = driver.get_object(container_name=self._container_name,
+                                    object_name=name)
 
-        return result
+            temp_name = '.%s.%s' % (basename, binascii.hexlify(os.urandom(4)))
+            temp_path = os.path.join(dirname, temp_name)
 
-    def _calculate_actions(self, differences, delete=False):
-        """
-        Return actions which need to be performed to make the remote copy match
-        a local one.
-        """
-        result = {'to_upload': [], 'to_remove': []}
+            try:
+                driver.download_object(obj=obj, destination_path=temp_path,
+                                       overwrite_existing=True,
+                                       delete_on_failure=True)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.unlink(temp_path)
+                raise
 
-        for item in chain(differences['added'].values(),
-                          differences['modified'].values()):
-            result['to_upload'].append(item)
+            return temp_path
 
-        if delete:
-            for item in differences['removed'].values():
-                result['to_remove'].append(item)
+        try:
+            temp_path = self._hedger.run(kind='download', func=download,
+                                         discard=os.unlink)
+        except ObjectDoesNotExistError:
+            self._logger.debug('Object ' + name + ' doesn\'t exist')
+            return False
 
-        return result
+        os.rename(temp_path, file_path)
+        return True
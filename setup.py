@@ -57,6 +57,13 @@ setup(
         'apache-libcloud>=0.13.0',
         'gevent'
     ],
+    extras_require={
+        # Python 2 backports needed by the asyncio backend
+        'asyncio': [
+            'trollius',
+            'futures'
+        ]
+    },
     url='https://github.com/Kami/python-file-syncer/',
     license='Apache License (2.0)',
     author='Tomaz Muraus',
@@ -0,0 +1,151 @@
+# Licensed to Tomaz Muraus under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Tomaz muraus licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from file_syncer.diff import SortedRun, iter_differences, sort_key
+from file_syncer.records import FileRecord
+
+
+def walk_order(names):
+    """
+    Return names ordered the same way as a sorted top-down directory walk
+    visits them.
+    """
+    return sorted(names, key=sort_key)
+
+
+class SortKeyTestCase(unittest.TestCase):
+    def test_root_files_come_before_sub_directories(self):
+        names = ['/a/y.txt', '/z.txt', '/a/b/x.txt', '/a.txt', '/m/q.txt']
+        self.assertEqual(walk_order(names), ['/a.txt', '/z.txt', '/a/y.txt',
+                                             '/a/b/x.txt', '/m/q.txt'])
+
+    def test_names_without_leading_slash(self):
+        self.assertEqual(sort_key('z.txt'), ((), 'z.txt'))
+        self.assertEqual(sort_key('a/y.txt'), (('a',), 'y.txt'))
+        self.assertEqual(sort_key('a/b/x.txt'), (('a', 'b'), 'x.txt'))
+
+        names = ['m/q.txt', 'z.txt', 'a/y.txt', 'a.txt']
+        self.assertEqual(walk_order(names), ['a.txt', 'z.txt', 'a/y.txt',
+                                             'm/q.txt'])
+
+    def test_same_key_with_and_without_leading_slash(self):
+        for name in ['z.txt', 'a/y.txt', 'a/b/x.txt']:
+            self.assertEqual(sort_key(name), sort_key('/' + name))
+
+    def test_directory_is_visited_as_a_whole(self):
+        # "a.b" sorts between "a" and "a/..." as a string, but the files in
+        # directory "a" come before directory "a.b"
+        names = ['/a.b/x', '/a/c/x', '/a/x']
+        self.assertEqual(walk_order(names), ['/a/x', '/a/c/x', '/a.b/x'])
+
+
+class IterDifferencesTestCase(unittest.TestCase):
+    def _records(self, values):
+        return [FileRecord(remote_name=name, last_modified=last_modified)
+                for name, last_modified in values]
+
+    def test_differences(self):
+        local = self._records([('added.txt', 1), ('same.txt', 1),
+                               ('a/modified.txt', 2), ('a/b/same.txt', 1)])
+        remote = self._records([('same.txt', 1), ('a/modified.txt', 1),
+                                ('a/removed.txt', 1), ('a/b/same.txt', 1)])
+
+        result = [(action, (local_item or remote_item).remote_name)
+                  for action, local_item, remote_item in
+                  iter_differences(local_records=local,
+                                   remote_records=remote)]
+        self.assertEqual(result, [('added', 'added.txt'),
+                                  ('unchanged', 'same.txt'),
+                                  ('modified', 'a/modified.txt'),
+                                  ('removed', 'a/removed.txt'),
+                                  ('unchanged', 'a/b/same.txt')])
+
+    def test_unchanged_tree_without_leading_slash(self):
+        names = walk_order(['z.txt', 'a/y.txt', 'm/q.txt', 'a/b/x.txt'])
+        records = self._records([(name, 1) for name in names])
+
+        actions = [action for action, _, _ in
+                   iter_differences(local_records=records,
+                                    remote_records=records)]
+        self.assertEqual(actions, ['unchanged'] * len(names))
+
+    def test_empty_streams(self):
+        records = self._records([('/a', 1)])
+
+        self.assertEqual(list(iter_differences([], [])), [])
+        self.assertEqual([action for action, _, _ in
+                          iter_differences(records, [])], ['added'])
+        self.assertEqual([action for action, _, _ in
+                          iter_differences([], records)], ['removed'])
+
+
+class SortedRunTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_spilled_records_are_merged_in_order(self):
+        names = ['/d%d/f%d' % (index % 7, index) for index in range(50)]
+        names += ['f%d' % (index) for index in range(10)]
+
+        run = SortedRun(directory=self.directory, max_items=8)
+
+        try:
+            for index, name in enumerate(reversed(names)):
+                run.add(FileRecord(remote_name=name, last_modified=index,
+                                   md5_hash='%032x' % (index), size=index))
+
+            self.assertEqual(len(run), len(names))
+            self.assertTrue(len(os.listdir(self.directory)) > 1)
+
+            result = [item.remote_name for item in run]
+            self.assertEqual(result, walk_order(names))
+
+            # Run can be iterated multiple times and the records are restored
+            # from the spilled files with all the attributes
+            items = list(run)
+            self.assertEqual([item.remote_name for item in items], result)
+            self.assertTrue(all([item.size is not None and item.md5_hash
+                                 for item in items]))
+        finally:
+            run.close()
+
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(list(run), [])
+
+    def test_custom_key(self):
+        run = SortedRun(directory=self.directory, max_items=2,
+                        key=lambda record: -record.size)
+
+        try:
+            for size in [3, 1, 4, 1, 5]:
+                run.add(FileRecord(remote_name='/f%d' % (size),
+                                   last_modified=0, size=size))
+
+            self.assertEqual([item.size for item in run], [5, 4, 3, 1, 1])
+        finally:
+            run.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# Licensed to Tomaz Muraus under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Tomaz muraus licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+
+from xml.etree import ElementTree
+
+from libcloud.storage.base import Container
+
+from file_syncer.extensions import S3Extension
+
+NAMESPACE = 'http://s3.amazonaws.com/doc/2006-03-01/'
+
+
+class MockResponse(object):
+    def __init__(self, status, body):
+        self.status = status
+        self.object = ElementTree.fromstring(body)
+
+
+class MockConnection(object):
+    def __init__(self, response):
+        self.response = response
+        self.requests = []
+
+    def request(self, path, method='GET', data=None, headers=None):
+        self.requests.append((path, method, data))
+        return self.response
+
+
+class MockS3Driver(object):
+    namespace = NAMESPACE
+
+    def __init__(self, response):
+        self.connection = MockConnection(response=response)
+
+    def _get_container_path(self, container):
+        return '/%s' % (container.name)
+
+
+class S3BulkDeleteTestCase(unittest.TestCase):
+    def test_errors_are_mapped_to_requested_names(self):
+        names = ['/ascii.txt', '/\xc5\xbeaba.txt', '/\xc4\x8dri.txt',
+                 '/deleted.txt', '/missing.txt']
+        errors = [('/ascii.txt', 'AccessDenied'),
+                  ('/\xc5\xbeaba.txt', 'InternalError'),
+                  ('/\xc4\x8dri.txt', 'AccessDenied'),
+                  ('/missing.txt', 'NoSuchKey')]
+
+        body = ['<?xml version="1.0" encoding="UTF-8"?>',
+                '<DeleteResult xmlns="%s">' % (NAMESPACE)]
+        for key, code in errors:
+            body.append('<Error><Key>%s</Key><Code>%s</Code>'
+                        '<Message>Failed</Message></Error>' % (key, code))
+        body.append('</DeleteResult>')
+
+        driver = MockS3Driver(response=MockResponse(status=200,
+                                                    body=''.join(body)))
+        container = Container(name='container', extra={}, driver=driver)
+        result = S3Extension(driver=driver).bulk_delete(container=container,
+                                                        names=names)
+
+        # Non-ASCII keys which are parsed as unicode map to the requested names
+        self.assertEqual(sorted(result.keys()),
+                         ['/ascii.txt', '/\xc4\x8dri.txt',
+                          '/\xc5\xbeaba.txt'])
+        self.assertTrue(all(isinstance(name, str) for name in result))
+        self.assertEqual(result['/\xc5\xbeaba.txt'], 'InternalError: Failed')
+
+        _, _, data = driver.connection.requests[0]
+        self.assertTrue('<Key>/\xc4\x8dri.txt</Key>' in data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+# Licensed to Tomaz Muraus under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Tomaz muraus licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import json
+import shutil
+import logging
+import tempfile
+import unittest
+
+from file_syncer.log import get_logger
+from file_syncer.simulator import SimulatedStorageDriver
+from file_syncer.sharding import get_shard, get_shard_object_name
+from file_syncer.sharding import is_internal_object, parse_manifest_section
+from file_syncer.syncer import FileSyncer
+from file_syncer.constants import MANIFEST_SHARD_FILE, LEASE_SHARD_FILE
+
+
+class GetShardTestCase(unittest.TestCase):
+    def test_files_are_assigned_by_leading_components(self):
+        names = ['/a/b/%d/f' % (index) for index in range(20)]
+
+        shards = set([get_shard(name, 4) for name in names])
+        self.assertEqual(shards, set([get_shard('/a', 4)]))
+
+        shards = set([get_shard(name, 4, depth=2) for name in names])
+        self.assertEqual(shards, set([get_shard('/a/b', 4, depth=2)]))
+
+        shards = set([get_shard(name, 4, depth=3) for name in names])
+        self.assertTrue(len(shards) > 1)
+
+        for name in names:
+            self.assertEqual(get_shard(name, 4, depth=3),
+                             get_shard(name.rsplit('/', 1)[0], 4, depth=3))
+
+    def test_less_deep_files_are_assigned_by_whole_path(self):
+        self.assertEqual(get_shard('/a/f', 4, depth=3),
+                         get_shard('a/f', 4, depth=2))
+        self.assertEqual(get_shard('/f', 4, depth=2), get_shard('/f', 4))
+
+    def test_object_names(self):
+        name = get_shard_object_name(template=MANIFEST_SHARD_FILE, index=1,
+                                     count=4)
+        self.assertEqual(name, 'manifest.1-of-4.json')
+        self.assertEqual(parse_manifest_section(name), (1, 4, 1))
+
+        name = get_shard_object_name(template=MANIFEST_SHARD_FILE, index=1,
+                                     count=4, depth=2)
+        self.assertEqual(name, 'manifest.1-of-4.depth-2.json')
+        self.assertEqual(parse_manifest_section(name), (1, 4, 2))
+        self.assertTrue(is_internal_object(name))
+
+        name = get_shard_object_name(template=LEASE_SHARD_FILE, index=0,
+                                     count=4, depth=3)
+        self.assertEqual(name, 'lease.0-of-4.depth-3.json')
+        self.assertEqual(parse_manifest_section(name), None)
+        self.assertTrue(is_internal_object(name))
+
+
+class ShardDepthTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.root = tempfile.mkdtemp()
+        self.cache_path = tempfile.mkdtemp()
+        self.names = set(['/root.txt', '/big/file.txt'])
+
+        for index in range(12):
+            self.names.add('/big/%d/file.txt' % (index))
+
+        for name in self.names:
+            file_path = os.path.join(self.directory, name.lstrip('/'))
+
+            if not os.path.exists(os.path.dirname(file_path)):
+                os.makedirs(os.path.dirname(file_path))
+
+            fp = open(file_path, 'wb')
+            fp.write(name)
+            fp.close()
+
+    def tearDown(self):
+        for path in [self.directory, self.root, self.cache_path]:
+            shutil.rmtree(path)
+
+    def test_single_top_level_directory_is_partitioned(self):
+        sections = []
+
+        for index in range(3):
+            syncer = self._get_syncer(shard_count=3, shard_index=index,
+                                      shard_depth=2)
+            walked = []
+            get_local_item = syncer._get_local_item
+
+            def get_item(base_path, dirpath, name):
+                walked.append(name)
+                return get_local_item(base_path=base_path, dirpath=dirpath,
+                                      name=name)
+
+            syncer._get_local_item = get_item
+            syncer.sync()
+
+            sections.append(set(self._get_manifest(
+                'manifest.%d-of-3.depth-2.json' % (index))))
+
+            # Other shards' directories are never visited
+            self.assertEqual(len(walked), len(sections[-1]))
+
+        self.assertTrue(all(sections))
+        self.assertEqual(set.union(*sections), self.names)
+        self.assertEqual(sum([len(section) for section in sections]),
+                         len(self.names))
+
+    def _get_syncer(self, **kwargs):
+        logger = get_logger(handler=logging.StreamHandler(),
+                            level=logging.ERROR)
+        syncer = FileSyncer(directory=self.directory,
+                            provider_cls=SimulatedStorageDriver,
+                            username=self.root, api_key='latency=0',
+                            container_name='container',
+                            cache_path=self.cache_path, exclude_patterns=[],
+                            logger=logger, **kwargs)
+        return syncer
+
+    def _get_manifest(self, name):
+        driver = SimulatedStorageDriver(self.root, 'latency=0')
+        obj = driver.get_object('container', name)
+        data = ''.join(driver.download_object_as_stream(obj=obj))
+        return json.loads(data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,250 @@
+# Licensed to Tomaz Muraus under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Tomaz muraus licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+import unittest
+
+from file_syncer.log import get_logger
+from file_syncer.simulator import SimulatedStorageDriver
+from file_syncer.syncer import FileSyncer, get_multipart_part_size
+
+
+class NonStreamingDriver(SimulatedStorageDriver):
+    """
+    Driver which can't stream uploads and returns the hash in the format
+    used by the providers which quote it (or return a multipart ETag).
+    """
+
+    supports_chunked_encoding = False
+    hash_format = '"%s"'
+
+    def upload_object(self, file_path, container, object_name, extra=None,
+                      verify_hash=True):
+        obj = super(NonStreamingDriver, self).upload_object(
+            file_path=file_path, container=container,
+            object_name=object_name, extra=extra, verify_hash=verify_hash)
+        obj.hash = self.hash_format % (obj.hash)
+        return obj
+
+
+class MultipartDriver(SimulatedStorageDriver):
+    """
+    Driver which streams uploads as S3 multipart uploads and records which
+    upload method was used and sizes of the streamed chunks.
+    """
+
+    supports_chunked_encoding = False
+    supports_s3_multipart_upload = True
+    uploads = []
+
+    def upload_object(self, file_path, container, object_name, extra=None,
+                      verify_hash=True):
+        self.uploads.append((object_name, 'upload_object', None))
+
+        # Simulated upload of a file is itself implemented as a stream upload
+        fp = open(file_path, 'rb')
+
+        try:
+            return super(MultipartDriver, self).upload_object_via_stream(
+                iterator=iter(lambda: fp.read(65536), ''),
+                container=container, object_name=object_name, extra=extra)
+        finally:
+            fp.close()
+
+    def upload_object_via_stream(self, iterator, container, object_name,
+                                 extra=None):
+        chunks = []
+
+        def iter_chunks():
+            for chunk in iterator:
+                chunks.append(len(chunk))
+                yield chunk
+
+        obj = super(MultipartDriver, self).upload_object_via_stream(
+            iterator=iter_chunks(), container=container,
+            object_name=object_name, extra=extra)
+        self.uploads.append((object_name, 'upload_object_via_stream',
+                             chunks))
+        return obj
+
+
+class UploadHashTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.root = tempfile.mkdtemp()
+        self.cache_path = tempfile.mkdtemp()
+
+        self.data = 'file content'
+        fp = open(os.path.join(self.directory, 'file.txt'), 'wb')
+        fp.write(self.data)
+        fp.close()
+
+    def tearDown(self):
+        for path in [self.directory, self.root, self.cache_path]:
+            shutil.rmtree(path)
+
+    def test_quoted_etag_is_normalized(self):
+        md5_hash = self._sync_and_get_manifest_hash(hash_format='"%s"')
+        self.assertEqual(md5_hash, hashlib.md5(self.data).hexdigest())
+
+    def test_multipart_etag_is_not_stored(self):
+        md5_hash = self._sync_and_get_manifest_hash(hash_format='"%s-2"')
+        self.assertEqual(md5_hash, None)
+
+    def _sync_and_get_manifest_hash(self, hash_format):
+        NonStreamingDriver.hash_format = hash_format
+        logger = get_logger(handler=logging.StreamHandler(),
+                            level=logging.ERROR)
+        syncer = FileSyncer(directory=self.directory,
+                            provider_cls=NonStreamingDriver,
+                            username=self.root, api_key='latency=0',
+                            container_name='container',
+                            cache_path=self.cache_path, exclude_patterns=[],
+                            logger=logger)
+        syncer.sync()
+
+        records = syncer._get_remote_run()
+
+        try:
+            items = list(records)
+        finally:
+            records.close()
+
+        self.assertEqual([item.remote_name for item in items],
+                         ['/file.txt'])
+        return items[0].md5_hash
+
+
+class MultipartUploadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.root = tempfile.mkdtemp()
+        self.cache_path = tempfile.mkdtemp()
+        self.part_size = get_multipart_part_size(driver=MultipartDriver)
+
+        for name, size in [('small.txt', 1024),
+                           ('part.txt', self.part_size),
+                           ('large.txt', 2 * self.part_size + 1)]:
+            fp = open(os.path.join(self.directory, name), 'wb')
+            fp.write('x' * size)
+            fp.close()
+
+        MultipartDriver.uploads = []
+
+    def tearDown(self):
+        for path in [self.directory, self.root, self.cache_path]:
+            shutil.rmtree(path)
+
+    def test_part_size(self):
+        self.assertTrue(self.part_size >= 5 * 1024 * 1024)
+        self.assertEqual(get_multipart_part_size(SimulatedStorageDriver),
+                         None)
+        self.assertEqual(get_multipart_part_size(NonStreamingDriver), None)
+
+    def test_small_files_are_uploaded_in_a_single_request(self):
+        logger = get_logger(handler=logging.StreamHandler(),
+                            level=logging.ERROR)
+        syncer = FileSyncer(directory=self.directory,
+                            provider_cls=MultipartDriver,
+                            username=self.root, api_key='latency=0',
+                            container_name='container',
+                            cache_path=self.cache_path, exclude_patterns=[],
+                            logger=logger)
+        syncer.sync()
+
+        uploads = dict([(name.lstrip('/'), (method, chunks))
+                        for name, method, chunks in
+                        MultipartDriver.uploads])
+
+        self.assertEqual(uploads['small.txt'], ('upload_object', None))
+        self.assertEqual(uploads['part.txt'], ('upload_object', None))
+
+        # Each chunk which is accounted for in the budget is a whole part
+        self.assertEqual(uploads['large.txt'],
+                         ('upload_object_via_stream',
+                          [self.part_size, self.part_size, 1]))
+
+
+class TrailingSlashTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.root = tempfile.mkdtemp()
+        self.cache_path = tempfile.mkdtemp()
+
+        for name in ['z.txt', 'a/y.txt', 'm/q.txt']:
+            file_path = os.path.join(self.directory, name)
+
+            if not os.path.exists(os.path.dirname(file_path)):
+                os.makedirs(os.path.dirname(file_path))
+
+            fp = open(file_path, 'wb')
+            fp.write(name)
+            fp.close()
+
+    def tearDown(self):
+        for path in [self.directory, self.root, self.cache_path]:
+            shutil.rmtree(path)
+
+    def test_unchanged_tree_is_not_modified(self):
+        self._get_syncer().sync(delete=True)
+
+        driver = SimulatedStorageDriver(self.root, 'latency=0')
+        container = driver.get_container('container')
+        names = sorted([obj.name for obj in
+                        driver.iterate_container_objects(container)])
+        self.assertEqual(names, ['a/y.txt', 'm/q.txt', 'manifest.json',
+                                 'z.txt'])
+
+        syncer = self._get_syncer()
+        upload_object = syncer._upload_object
+        remove_objects = syncer._remove_objects
+        uploaded = []
+        removed = []
+
+        def upload(item, pool):
+            uploaded.append(item.remote_name)
+            return upload_object(item=item, pool=pool)
+
+        def remove(items, pool):
+            removed.extend([item.remote_name for item in items])
+            return remove_objects(items=items, pool=pool)
+
+        syncer._upload_object = upload
+        syncer._remove_objects = remove
+        syncer.sync(delete=True)
+
+        self.assertEqual(uploaded, [])
+        self.assertEqual(removed, [])
+        self.assertEqual(sorted([obj.name for obj in
+                                 driver.iterate_container_objects(container)]),
+                         names)
+
+    def _get_syncer(self):
+        logger = get_logger(handler=logging.StreamHandler(),
+                            level=logging.ERROR)
+        return FileSyncer(directory=self.directory + '/',
+                          provider_cls=SimulatedStorageDriver,
+                          username=self.root, api_key='latency=0',
+                          container_name='container',
+                          cache_path=self.cache_path, exclude_patterns=[],
+                          logger=logger)
+
+
+if __name__ == '__main__':
+    unittest.main()